@@ -0,0 +1,140 @@
+import hashlib
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+import pygame
+
+# ----------------------------------------------------------------
+#                   CACHÉ DE RECURSOS
+# ----------------------------------------------------------------
+# The client only ever draws its PNGs at 20-40 px, and the track mask is
+# rasterized from the same polygons on every launch. load() keeps both,
+# already preprocessed, in one cache file: images scaled and turned to
+# their display size as raw RGBA (ready for convert_alpha()) and masks as
+# packed bits. The file is keyed by a hash of the source files and of the
+# parameters, so editing a PNG or the track rebuilds it; otherwise startup
+# is a single read.
+#
+# Layout: HEADER, then one ENTRY per asset, then the data the entries
+# point at (offsets relative to the end of the entry table).
+
+MAGIC = b"ASST"
+VERSION = 1  # Bump when the preprocessing itself changes
+HEADER = struct.Struct("<4sH20sI")   # magic, version, source hash, entry count
+ENTRY = struct.Struct("<24sBHHII")   # name, kind, width, height, data offset, data length
+KIND_IMAGE = 0
+KIND_MASK = 1
+CACHE_FILE = "assets.cache"
+
+ImageSpec = namedtuple("ImageSpec", "path size angle", defaults=(0,))
+MaskSpec = namedtuple("MaskSpec", "params build sources", defaults=((),))
+Assets = namedtuple("Assets", "images masks")
+
+
+def source_hash(images, masks):
+    """SHA-1 over the cache version, every spec and the bytes of every source file"""
+    digest = hashlib.sha1(struct.pack("<H", VERSION))
+    for name, spec in sorted(images.items()):
+        digest.update(repr((name, spec)).encode("utf-8"))
+        with open(spec.path, "rb") as f:
+            digest.update(f.read())
+    for name, spec in sorted(masks.items()):
+        digest.update(repr((name, spec.params, spec.sources)).encode("utf-8"))
+        for path in spec.sources:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.digest()
+
+
+def _build(images, masks):
+    """Decode, scale and rasterize everything from the sources"""
+    surfaces = {}
+    for name, spec in images.items():
+        image = pygame.transform.scale(pygame.image.load(spec.path), spec.size)
+        if spec.angle:
+            image = pygame.transform.rotate(image, spec.angle)
+        surfaces[name] = image
+    return Assets(surfaces, {name: spec.build() for name, spec in masks.items()})
+
+
+def _write(path, key, assets):
+    entries = []
+    blobs = []
+    offset = 0
+    for name, surface in assets.images.items():
+        data = pygame.image.tobytes(surface, "RGBA")
+        entries.append((name, KIND_IMAGE, *surface.get_size(), offset, len(data)))
+        blobs.append(data)
+        offset += len(data)
+    for name, mask in assets.masks.items():
+        data = np.packbits(mask).tobytes()
+        entries.append((name, KIND_MASK, mask.shape[1], mask.shape[0], offset, len(data)))
+        blobs.append(data)
+        offset += len(data)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, key, len(entries)))
+        for name, *fields in entries:
+            f.write(ENTRY.pack(name.encode("utf-8"), *fields))
+        for data in blobs:
+            f.write(data)
+    os.replace(temporary, path)
+
+
+def _read(path, key):
+    """Return the cached Assets, or None if the file is missing, stale or damaged"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, version, cached_key, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or cached_key != key:
+        return None
+    start = HEADER.size + count * ENTRY.size
+    if start > len(data):
+        return None  # Cut off inside the entry table
+    images = {}
+    masks = {}
+    try:
+        for i in range(count):
+            name, kind, width, height, offset, length = ENTRY.unpack_from(data, HEADER.size + i * ENTRY.size)
+            name = name.rstrip(b"\0").decode("utf-8")
+            begin = start + offset
+            if begin + length > len(data):
+                return None
+            if kind == KIND_IMAGE:
+                images[name] = pygame.image.frombuffer(data[begin:begin + length], (width, height), "RGBA")
+            else:
+                bits = np.frombuffer(data, dtype=np.uint8, count=length, offset=begin)
+                masks[name] = np.unpackbits(bits, count=width * height).view(bool).reshape(height, width)
+    except (struct.error, ValueError):
+        return None  # Entries that do not match their data (UnicodeDecodeError is a ValueError)
+    return Assets(images, masks)
+
+
+def load(images, masks=None, path=CACHE_FILE):
+    """Return Assets({name: Surface}, {name: bool array}) for the given specs.
+
+    images maps names to ImageSpec(path, display size, rotation); masks maps
+    names to MaskSpec(params, build, sources), where build() returns the
+    mask and params/sources are everything it depends on.
+    """
+    masks = masks or {}
+    key = source_hash(images, masks)
+    assets = _read(path, key)
+    if assets is not None and assets.images.keys() == images.keys() and assets.masks.keys() == masks.keys():
+        return assets
+    assets = _build(images, masks)
+    try:
+        _write(path, key, assets)
+    except OSError as e:
+        print(f"Could not write the asset cache: {e}")
+        return assets
+    print(f"Asset cache rebuilt: {path}")
+    # Hand out what later launches will get, so both paths draw the same pixels
+    return _read(path, key) or assets
@@ -0,0 +1,144 @@
+import numpy as np
+
+import simulation
+from simulation import (ACCELERATION, FRICTION, GRASS_SLOWDOWN, MAX_SPEED, PHYSICS_FPS,
+                        START_ANGLE, TURNING_SPEED, EXPLOSION_DURATION)
+
+# ----------------------------------------------------------------
+#                   FÍSICA VECTORIZADA
+# ----------------------------------------------------------------
+# Struct-of-arrays version of simulation.step(): every field of CarState is
+# a NumPy array with one entry per car, and step_batch() advances all cars
+# with whole-array operations. Used for server-side validation and large
+# bot fields; a single car follows the same rules as simulation.step().
+
+class CarBatch:
+    """State of N cars as parallel NumPy arrays"""
+
+    def __init__(self, count, start_position, angle=START_ANGLE, now=0.0):
+        self.count = count
+        self.positions = np.tile(np.asarray(start_position, dtype=np.float64), (count, 1))
+        self.velocities = np.zeros((count, 2))
+        self.angles = np.full(count, float(angle))
+        self.speeds = np.zeros(count)
+        self.acceleration_time = np.zeros(count)
+        self.on_track = np.ones(count, dtype=bool)
+
+        self.time = now
+        self.lap_count = np.zeros(count, dtype=np.int32)
+        self.checkpoint_index = np.zeros(count, dtype=np.int32)
+        self.checkpoint_hit = np.zeros(count, dtype=bool)
+        self.best_lap = np.full(count, np.inf)
+        self.current_lap_start = np.full(count, float(now))
+        self.last_lap_time = np.zeros(count)
+        self.lap_time_sum = np.zeros(count)
+        self.total_time = np.zeros(count)
+        self.finished = np.zeros(count, dtype=bool)
+
+        self.exploding = np.zeros(count, dtype=bool)
+        self.explosion_start = np.zeros(count)
+
+
+class BatchEvents:
+    """Indices of the cars that produced each kind of event in one step"""
+
+    def __init__(self, checkpoint, lap, finished, bomb):
+        self.checkpoint = checkpoint
+        self.lap = lap
+        self.finished = finished
+        self.bomb = bomb
+
+
+def _car_rects(positions, car_size):
+    # Truncate towards zero like pygame.Rect / simulation.car_rect
+    x = np.trunc(positions[:, 0] - car_size[0] / 2)
+    y = np.trunc(positions[:, 1] - car_size[1] / 2)
+    return x, y
+
+def _overlap(x, y, car_size, rects):
+    """rects: (N, 4) or (4,) array of (x, y, w, h); same test as rects_overlap"""
+    rects = np.asarray(rects, dtype=np.float64)
+    rx, ry, rw, rh = rects[..., 0], rects[..., 1], rects[..., 2], rects[..., 3]
+    return (x < rx + rw) & (rx < x + car_size[0]) & (y < ry + rh) & (ry < y + car_size[1])
+
+
+def step_batch(batch, left, right, up, down, dt, world=None, clock=None):
+    """Advance every car in the batch by dt seconds.
+
+    left/right/up/down are boolean arrays with one entry per car. Returns a
+    BatchEvents with the indices of cars that hit a checkpoint, finished a
+    lap, finished the race or hit a bomb.
+    """
+    world = world or simulation.default_world()
+    batch.time += dt
+    now = clock() if clock is not None else batch.time
+    frames = dt * PHYSICS_FPS
+    left, right, up, down = (np.asarray(a, dtype=bool) for a in (left, right, up, down))
+
+    # Controles
+    turn = TURNING_SPEED * 1.2 * frames
+    batch.angles += np.where(left, turn, 0.0)
+    batch.angles -= np.where(right, turn, 0.0)
+
+    down = down & ~up
+    pedal = up | down
+    batch.acceleration_time = np.where(pedal, batch.acceleration_time + dt, 0.0)
+    accel = ACCELERATION * np.minimum(batch.acceleration_time, 3.0) * frames
+    decel = ACCELERATION * np.minimum(batch.acceleration_time, 2.0) * frames
+    coast = batch.speeds * (1 - FRICTION * 1.5) ** frames
+    batch.speeds = np.where(up, np.minimum(batch.speeds + accel, MAX_SPEED),
+                            np.where(down, np.maximum(batch.speeds - decel, -MAX_SPEED / 2.5), coast))
+
+    # Pista/césped
+    batch.on_track = world.field.on_track_many(batch.positions[:, 0], batch.positions[:, 1], batch.angles)
+    batch.speeds *= np.where(batch.on_track, (1 - FRICTION) ** frames, (1 - FRICTION - GRASS_SLOWDOWN) ** frames)
+
+    # Posición
+    angle_rad = np.radians(batch.angles)
+    batch.velocities[:, 0] = np.sin(angle_rad) * batch.speeds
+    batch.velocities[:, 1] = np.cos(angle_rad) * batch.speeds
+    batch.positions += batch.velocities * frames
+    np.clip(batch.positions[:, 0], 0, world.size[0], out=batch.positions[:, 0])
+    np.clip(batch.positions[:, 1], 0, world.size[1], out=batch.positions[:, 1])
+
+    x, y = _car_rects(batch.positions, world.car_size)
+
+    # Checkpoints
+    checkpoints = np.asarray(world.checkpoints, dtype=np.float64)
+    count = len(checkpoints)
+    active = batch.checkpoint_index < count
+    targets = checkpoints[np.minimum(batch.checkpoint_index, count - 1)]
+    touching = active & _overlap(x, y, world.car_size, targets)
+    reached = touching & ~batch.checkpoint_hit
+    batch.checkpoint_index += reached
+    batch.checkpoint_hit = np.where(active, touching, batch.checkpoint_hit)
+
+    # Meta
+    lapped = (batch.checkpoint_index >= count) & _overlap(x, y, world.car_size, world.finish_line)
+    lap_time = now - batch.current_lap_start
+    batch.lap_count += lapped
+    batch.last_lap_time = np.where(lapped, lap_time, batch.last_lap_time)
+    batch.lap_time_sum = np.where(lapped, batch.lap_time_sum + lap_time, batch.lap_time_sum)
+    batch.best_lap = np.where(lapped, np.minimum(batch.best_lap, lap_time), batch.best_lap)
+    batch.checkpoint_index[lapped] = 0
+    batch.current_lap_start = np.where(lapped, now, batch.current_lap_start)
+    done = lapped & (batch.lap_count >= world.max_laps)
+    batch.finished |= done
+    batch.total_time = np.where(done, batch.lap_time_sum, batch.total_time)
+    batch.speeds[done] = 0
+
+    # Bombas
+    batch.exploding &= now - batch.explosion_start < EXPLOSION_DURATION
+    bombed = np.zeros(batch.count, dtype=bool)
+    for bomb in world.bombs:
+        hit = ~batch.exploding & _overlap(x, y, world.car_size, bomb)
+        batch.exploding |= hit
+        bombed |= hit
+    if bombed.any():
+        batch.speeds[bombed] = 0
+        batch.positions[bombed] = world.start_position
+        batch.angles[bombed] = START_ANGLE
+        batch.explosion_start[bombed] = now
+
+    return BatchEvents(np.flatnonzero(reached), np.flatnonzero(lapped),
+                       np.flatnonzero(done), np.flatnonzero(bombed))
@@ -0,0 +1,211 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import socket
+import sys
+import tempfile
+from unittest import mock
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import pygame
+
+import batch_physics
+import ghost
+import interpolation
+import profiling
+import simulation
+import track
+
+# ----------------------------------------------------------------
+#                   BENCHMARK DEL CLIENTE
+# ----------------------------------------------------------------
+# Runs the real client.py headlessly (SDL dummy video driver, no server)
+# for a fixed number of frames: the local car is driven by a script that
+# steers towards the next checkpoint and a field of remote players is fed
+# to the interpolator every frame. The client's frame_profiler gives the
+# time of each stage; the result can be stored as a baseline and later
+# runs are compared against it.
+
+CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "client.py")
+FRAMES = 600
+WARMUP = 60               # Frames run before measuring (static layer, caches)
+REMOTE_PLAYERS = 7
+BASELINE = "benchmark_baseline.json"
+TOLERANCE = 0.25          # Relative slowdown that counts as a regression
+MIN_REGRESSION_MS = 0.05  # Smaller slowdowns are timer noise on tiny stages
+
+
+class ScriptedKeys:
+    """Stands in for pygame.key.get_pressed(): the pressed keys of this frame"""
+
+    def __init__(self, pressed=()):
+        self.pressed = set(pressed)
+
+    def __getitem__(self, key):
+        return key in self.pressed
+
+
+def steer_to_checkpoint(state, world):
+    """Accelerate and turn towards the next checkpoint (or the finish line)"""
+    if state.checkpoint_index < len(world.checkpoints):
+        target = simulation.rect_center(world.checkpoints[state.checkpoint_index])
+    else:
+        target = simulation.rect_center(world.finish_line)
+    wanted = math.degrees(math.atan2(target[0] - state.position[0], target[1] - state.position[1]))
+    turn = interpolation.angle_difference(state.angle, wanted)
+    pressed = {pygame.K_UP}
+    if turn > 5:
+        pressed.add(pygame.K_LEFT)
+    elif turn < -5:
+        pressed.add(pygame.K_RIGHT)
+    return ScriptedKeys(pressed)
+
+
+class BenchmarkClock:
+    """Replaces the client's pygame.time.Clock: counts frames, moves the remote
+    players and ends the run. Everything here happens before the client
+    starts timing the frame."""
+
+    def __init__(self, g, frames, warmup, remote_players, capped, seed=1):
+        self.g = g
+        self.frames = frames
+        self.warmup = warmup
+        self.capped = capped
+        self.clock = pygame.time.Clock()
+        self.ticks = 0
+        self.world = simulation.default_world()
+        self.remote = batch_physics.CarBatch(remote_players, track.start_position)
+        self.rng = np.random.default_rng(seed)
+        self.steering = np.zeros(remote_players, dtype=np.int8)
+
+    def tick(self, fps=0):
+        self.ticks += 1
+        if self.ticks == self.warmup + 1:
+            self.g["frame_profiler"].reset()
+        elif self.ticks == self.warmup + self.frames + 1:
+            pygame.event.post(pygame.event.Event(pygame.QUIT))
+        self.move_remote_players(fps)
+        return self.clock.tick(fps) if self.capped else self.clock.tick()
+
+    def move_remote_players(self, fps):
+        count = self.remote.count
+        if not count:
+            return
+        change = self.rng.random(count) < 0.05
+        self.steering[change] = self.rng.integers(-1, 2, change.sum())
+        batch_physics.step_batch(self.remote, self.steering > 0, self.steering < 0,
+                                 np.ones(count, dtype=bool), np.zeros(count, dtype=bool),
+                                 1.0 / (fps or simulation.PHYSICS_FPS), self.world)
+        players = {
+            player_id: {"position": position, "angle": angle, "lap": lap, "checkpoints": 0, "finished": False}
+            for player_id, position, angle, lap in zip(range(2, count + 2), self.remote.positions.tolist(),
+                                                        self.remote.angles.tolist(), self.remote.lap_count.tolist())
+        }
+        self.g["players"] = players
+        self.g["remote_cars"].push(players, self.g["time"].monotonic())
+
+
+def run_client(frames=FRAMES, warmup=WARMUP, remote_players=REMOTE_PLAYERS, capped=False):
+    """Run client.py headlessly and return its frame_profiler summary"""
+    g = {"__name__": "__main__", "__file__": CLIENT}
+    bench_clock = BenchmarkClock(g, frames, warmup, remote_players, capped)
+
+    def get_pressed():
+        player_car = g.get("player_car")
+        return steer_to_checkpoint(player_car, bench_clock.world) if player_car else ScriptedKeys()
+
+    with open(CLIENT, encoding="utf-8") as f:
+        code = compile(f.read(), CLIENT, "exec")
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(CLIENT))  # Images are loaded relative to the client
+    try:
+        # Keep the player's saved ghost out of the scripted laps, and every measured frame
+        with tempfile.TemporaryDirectory() as scratch, \
+                mock.patch.object(ghost, "GHOST_FILE", os.path.join(scratch, ghost.GHOST_FILE)), \
+                mock.patch.object(profiling, "HISTORY", max(frames, profiling.HISTORY)), \
+                mock.patch.object(socket.socket, "connect", side_effect=ConnectionRefusedError), \
+                mock.patch.object(sys, "argv", [CLIENT]), \
+                mock.patch("pygame.time.Clock", lambda: bench_clock), \
+                mock.patch("pygame.key.get_pressed", get_pressed), \
+                contextlib.redirect_stdout(io.StringIO()):
+            exec(code, g)
+    finally:
+        os.chdir(cwd)
+    return g["frame_profiler"].summary()
+
+
+# ----------------------------------------------------------------
+#                   INFORME Y LÍNEA BASE
+# ----------------------------------------------------------------
+
+def compare(summary, baseline, tolerance=TOLERANCE):
+    """Return {stage: [metric, ...]} for the metrics slower than the baseline"""
+    regressions = {}
+    for stage, base in baseline.items():
+        current = summary.get(stage)
+        if current is None:
+            continue
+        slower = [metric for metric in ("p50", "p90")
+                  if current[metric] > base[metric] * (1 + tolerance)
+                  and current[metric] - base[metric] > MIN_REGRESSION_MS]
+        if slower:
+            regressions[stage] = slower
+    return regressions
+
+def print_report(summary, baseline=None, regressions=None):
+    regressions = regressions or {}
+    header = f"{'stage':<12} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}"
+    if baseline:
+        header += f" {'base p50':>9} {'base p90':>9}"
+    print(header + "   (ms)")
+    for stage, stats in summary.items():
+        line = f"{stage:<12} " + " ".join(f"{stats[m]:8.3f}" for m in ("mean", "p50", "p90", "p99", "max"))
+        base = (baseline or {}).get(stage)
+        if base:
+            line += f" {base['p50']:9.3f} {base['p90']:9.3f}"
+        if stage in regressions:
+            line += "   REGRESSION (" + ", ".join(regressions[stage]) + ")"
+        print(line)
+    frame = summary.get("frame")
+    if frame:
+        print(f"~{1000.0 / frame['mean']:.0f} FPS uncapped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless per-stage frame-time benchmark of client.py")
+    parser.add_argument("--frames", type=int, default=FRAMES)
+    parser.add_argument("--warmup", type=int, default=WARMUP)
+    parser.add_argument("--remote-players", type=int, default=REMOTE_PLAYERS)
+    parser.add_argument("--capped", action="store_true", help="keep the client's 60 FPS limiter")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file to compare with or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="relative slowdown of p50/p90 that counts as a regression")
+    args = parser.parse_args()
+
+    config = {"frames": args.frames, "remote_players": args.remote_players, "capped": args.capped}
+    summary = run_client(args.frames, args.warmup, args.remote_players, args.capped)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"config": config, "stages": summary}, f, indent=2)
+        print_report(summary)
+        print(f"Baseline saved to {args.baseline}")
+        sys.exit(0)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored["stages"]
+        if stored.get("config") != config:
+            print(f"Warning: baseline was recorded with {stored.get('config')}, this run uses {config}")
+    regressions = compare(summary, baseline, args.tolerance) if baseline else {}
+    print_report(summary, baseline, regressions)
+    sys.exit(1 if regressions else 0)
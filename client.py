@@ -1,9 +1,21 @@
 import socket
+import sys
 import threading
-import json
 import pygame
 import time
-import math
+
+import assets
+import ghost
+import interest
+import interpolation
+import profiling
+import protocol
+import render
+import sender
+import simulation
+import snapshots
+import spatial
+import track
 
 # ----------------------------------------------------------------
 #                   CONFIGURACIÓN INICIAL
@@ -12,29 +24,45 @@ SERVER_IP = '192.168.33.68'
 SERVER_PORT = 5555
 
 pygame.init()
-SCREEN_WIDTH, SCREEN_HEIGHT = 1441, 768
-CAR_WIDTH, CAR_HEIGHT = 30, 20
+SCREEN_WIDTH, SCREEN_HEIGHT = track.FIELD_SIZE
+CAR_WIDTH, CAR_HEIGHT = track.CAR_SIZE
 FPS = 60
 
 # ----------------------------------------------------------------
 #                   CARGA DE IMÁGENES
 # ----------------------------------------------------------------
-bomb_image = pygame.image.load('bomb.png')
-bomb_image = pygame.transform.scale(bomb_image, (20, 20))
-explosion_image = pygame.image.load('explosion.png')
-explosion_image = pygame.transform.scale(explosion_image, (40, 40))
-
-# Explosión
-explosion_pos = None
-explosion_start = 0
-EXPLOSION_DURATION = 0.5
+# Imágenes ya escaladas y máscara de la pista salen de assets.cache; solo
+# se decodifican los PNG (y se rasteriza la pista) si cambió alguna fuente.
+PLAYER_COLORS = ['blue', 'red', 'green', 'yellow']
+CAR_ROTATION_STEP = 1.0  # Resolución angular del atlas en grados
+DIRTY_RECTS = False      # Repintar y enviar a pantalla solo lo que cambia (pantallas por software)
+GHOST_ALPHA = 110        # Opacidad del coche fantasma (0-255)
+IMAGE_ASSETS = {
+    'bomb': assets.ImageSpec('bomb.png', (20, 20)),
+    'explosion': assets.ImageSpec('explosion.png', (40, 40)),
+    **{f'car_{color}': assets.ImageSpec(f'car_{color}.png', (CAR_WIDTH, CAR_HEIGHT), 270) for color in PLAYER_COLORS},
+}
+MASK_ASSETS = {
+    'track': assets.MaskSpec((SCREEN_WIDTH, SCREEN_HEIGHT),
+                             lambda: track.TrackField.from_polygons(size=(SCREEN_WIDTH, SCREEN_HEIGHT)).occupancy,
+                             ('track.py',)),
+}
+game_assets = assets.load(IMAGE_ASSETS, MASK_ASSETS)
+
+bomb_image = game_assets.images['bomb']
+explosion_image = game_assets.images['explosion']
+# Coches: las rotaciones se precalculan en el atlas
+car_images = {color: game_assets.images[f'car_{color}'] for color in PLAYER_COLORS}
 
 # ----------------------------------------------------------------
 #                   FUENTES (más pequeñas)
 # ----------------------------------------------------------------
-font = pygame.font.SysFont("Arial", 20)        # Texto general
-title_font = pygame.font.SysFont("Arial", 28, bold=True)  # Título reducido
-data_font = pygame.font.SysFont("Arial", 18)   # Texto pequeño para UI
+fonts = render.FontRegistry()                  # Cada fuente se resuelve una sola vez
+font = fonts.get("Arial", 20)                  # Texto general
+title_font = fonts.get("Arial", 28, bold=True) # Título reducido
+data_font = fonts.get("Arial", 18)             # Texto pequeño para UI
+label_font = fonts.get("Arial", 18, bold=True) # Títulos del HUD
+text_cache = render.TextCache()                # Textos ya renderizados (LRU)
 
 # ----------------------------------------------------------------
 #                   COLORES
@@ -68,12 +96,8 @@ GREEN = (0, 200, 80)
 # ----------------------------------------------------------------
 #                   FÍSICA
 # ----------------------------------------------------------------
-ACCELERATION = 0.1
-TURNING_SPEED = 4.0
-FRICTION = 0.01
-MAX_SPEED = 9.5
-DRIFT_FACTOR = 0.55
-GRASS_SLOWDOWN = 0.4
+# Constantes, controles, checkpoints, vueltas y bombas viven en
+# simulation.py, que no necesita pantalla.
 
 # ----------------------------------------------------------------
 #                   FUNCIÓN DEGRADADO
@@ -88,85 +112,18 @@ def draw_vertical_gradient(surface, color_top, color_bottom):
         b = int(color_top[2] * (1 - ratio) + color_bottom[2] * ratio)
         pygame.draw.line(surface, (r, g, b), (0, y), (width, y))
 
-# ----------------------------------------------------------------
-#                   CLASE COCHE
-# ----------------------------------------------------------------
-class Car:
-    def __init__(self, x, y):
-        self.position = [x, y]
-        self.velocity = [0, 0]
-        self.angle = 0
-        self.speed = 0
-        self.acceleration_time = 0
-        self.checkpoint_times = []
-        self.best_lap = float('inf')
-        self.current_lap_start = time.time()
-        self.last_lap_time = 0
-        self.id = str(time.time())  # Unique ID for each car
-        
-
 # ----------------------------------------------------------------
 #                   DEFINICIÓN DE PISTA CON OFFSET
 # ----------------------------------------------------------------
-offset_y = 70  # Reservamos 70px arriba para el header
-
-track_outer_original = [
-    (50, 50), (1350, 50), (1350, 300),
-    (1050, 300), (1050, 400), (1350, 400),
-    (1350, 600), (550, 600), (400, 450),
-    (250, 450), (150, 550), (50, 450),
-    (50, 50)
-]
-track_inner_original = [
-    (150, 150), (1250, 150), (1250, 200),
-    (950, 200), (950, 500), (1250, 500),
-    (1250, 500), (550, 500), (450, 400),
-    (350, 400), (200, 400), (150, 350),
-    (150, 150)
-]
-
-# Aplicamos offset vertical
-track_outer = [(x, y + offset_y) for x, y in track_outer_original]
-track_inner = [(x, y + offset_y) for x, y in track_inner_original]
-
-# Posición inicial del coche
-start_position_original = [120, 100]
-start_position = [start_position_original[0], start_position_original[1] + offset_y]
-
-# Checkpoints
-checkpoints_original = [
-    pygame.Rect(350, 50, 40, 40),
-    pygame.Rect(750, 110, 40, 40),
-    pygame.Rect(950, 350, 40, 40),
-    pygame.Rect(900, 500, 40, 40),
-    pygame.Rect(550, 500, 40, 40),
-    pygame.Rect(350, 400, 40, 50),
-    pygame.Rect(50, 300, 40, 40),
-]
-checkpoints = []
-for rect in checkpoints_original:
-    new_rect = pygame.Rect(rect.x, rect.y + offset_y, rect.width, rect.height)
-    checkpoints.append(new_rect)
-
-# Línea de meta
-finish_line_original = pygame.Rect(50, 150, 50, 50)
-finish_line = pygame.Rect(
-    finish_line_original.x,
-    finish_line_original.y + offset_y,
-    finish_line_original.width,
-    finish_line_original.height
-)
-
-# Bombas
-bombs_original = [
-    pygame.Rect(300, 100, 10, 10),
-    pygame.Rect(1000, 500, 10, 10),
-    pygame.Rect(700, 530, 10, 10),
-]
-bombs = []
-for rect in bombs_original:
-    new_rect = pygame.Rect(rect.x, rect.y + offset_y, rect.width, rect.height)
-    bombs.append(new_rect)
+# La geometría vive en track.py (compartida con el servidor)
+offset_y = track.offset_y
+track_outer = track.track_outer
+track_inner = track.track_inner
+start_position = track.start_position
+
+checkpoints = [pygame.Rect(rect) for rect in track.checkpoints]
+finish_line = pygame.Rect(track.finish_line)
+bombs = [pygame.Rect(rect) for rect in track.bombs]
 
 # ----------------------------------------------------------------
 #                   SUPERFICIE DE LA PISTA
@@ -177,103 +134,203 @@ track_surface.fill((0, 0, 0, 0))
 pygame.draw.rect(track_surface, GRASS_COLOR, (0, 0, SCREEN_WIDTH, SCREEN_HEIGHT))
 pygame.draw.polygon(track_surface, TRACK_COLOR, track_outer)
 pygame.draw.polygon(track_surface, GRASS_COLOR, track_inner)
-pygame.draw.lines(track_surface, TRACK_BORDER_COLOR, True, track_outer, 5)
-pygame.draw.lines(track_surface, TRACK_BORDER_COLOR, True, track_inner, 5)
+pygame.draw.lines(track_surface, TRACK_BORDER_COLOR, True, track_outer, track.BORDER_WIDTH)
+pygame.draw.lines(track_surface, TRACK_BORDER_COLOR, True, track_inner, track.BORDER_WIDTH)
+
+# Rejilla de colisión precalculada (misma decisión del 30% de solape), de la caché
+track_field = track.TrackField(game_assets.masks['track'], (CAR_WIDTH, CAR_HEIGHT))
+world = simulation.World(field=track_field, size=(SCREEN_WIDTH, SCREEN_HEIGHT), car_size=(CAR_WIDTH, CAR_HEIGHT))
+
+# ----------------------------------------------------------------
+#                   CAPA ESTÁTICA
+# ----------------------------------------------------------------
+def draw_static_scene(surface):
+    """Fondo, pista, header, título, línea de meta y bombas: todo lo que no cambia"""
+    width = surface.get_width()
+
+    # Fondo con degradado y pista (incluyendo césped y bordes)
+    draw_vertical_gradient(surface, BG_TOP, BG_BOTTOM)
+    surface.blit(track_surface, (0, 0))
+
+    # Header semitransparente
+    header_surface = pygame.Surface((width, offset_y), pygame.SRCALPHA)
+    header_surface.fill((0, 0, 0, 180))  # Made slightly more opaque
+    surface.blit(header_surface, (0, 0))
+
+    # Título centrado
+    title_str = "RACING GAME: VELOCITY UNLEASHED"
+    # Changed from TITLE_COLOR to a bright white with slight blue tint
+    title_surf = title_font.render(title_str, True, (240, 250, 255))
+    title_rect = title_surf.get_rect(center=(width // 2, offset_y // 2))
+    surface.blit(title_surf, title_rect)
+
+    # Bombas
+    for bomb in bombs:
+        bomb_rect = bomb_image.get_rect(center=bomb.center)
+        surface.blit(bomb_image, bomb_rect)
 
-track_mask = pygame.mask.from_threshold(track_surface, TRACK_COLOR, (1, 1, 1, 255))
+    # Línea de meta
+    for i in range(10):
+        c = BLACK if i % 2 == 0 else WHITE
+        pygame.draw.rect(surface, c, (finish_line.x + i*10, finish_line.y, 10, finish_line.height))
 
-def is_on_track(pos, car_width, car_height, angle):
-    car_surface = pygame.Surface((car_width * 0.8, car_height * 0.8), pygame.SRCALPHA)
-    pygame.draw.rect(car_surface, (255, 255, 255, 128), (0, 0, car_width * 0.8, car_height * 0.8))
-    rotated_car = pygame.transform.rotate(car_surface, angle)
-    car_rect = rotated_car.get_rect(center=pos)
-    car_mask = pygame.mask.from_surface(rotated_car)
-    offset = (car_rect.x, car_rect.y)
-    overlap = track_mask.overlap_area(car_mask, offset)
-    return overlap > (car_width * car_height * 0.3)
+# Se construye una sola vez (y de nuevo si cambia el tamaño o la pista)
+static_layer = render.StaticLayer(draw_static_scene)
 
 # ----------------------------------------------------------------
 #                   MULTIJUGADOR
 # ----------------------------------------------------------------
 players = {}
+WIRE_FORMAT = protocol.FORMAT_BINARY   # FORMAT_JSON para depurar el tráfico
+USE_UDP = True  # Posiciones por UDP si el servidor lo acepta; TCP para eventos
+RACE_ROOM = sys.argv[1] if len(sys.argv) > 1 else protocol.DEFAULT_ROOM  # Sala de carrera
+SEND_RATE = 30  # Envíos de posición por segundo, independientes de FPS
 client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+connected = False
 try:
     client_socket.connect((SERVER_IP, SERVER_PORT))
+    client_socket.sendall(protocol.encode_hello(WIRE_FORMAT, flags=protocol.HELLO_UDP if USE_UDP else 0,
+                                                room=RACE_ROOM))
+    connected = True
 except:
     print("Could not connect to server. Running in single player mode.")
 
 # Add near the top with other global variables
 game_winner = None
 race_positions = []
+my_player_id = None  # Asignado por el servidor en el HELLO
+delta_receiver = snapshots.DeltaReceiver()
+acked_tick = snapshots.NO_BASELINE  # Último snapshot confirmado al servidor
+udp_socket = None
+udp_token = 0
+udp_sequence = 0
+last_reliable_state = None  # (vuelta, terminado) enviado por TCP
+# Los coches remotos se dibujan interpolados entre snapshots recibidos
+remote_cars = interpolation.SnapshotInterpolator(simulation.MAX_SPEED, simulation.TURNING_SPEED * 1.2, FPS)
+car_grid = spatial.SpatialHash()  # Remote cars, for bumping into them
+
+def handle_message(kind, payload):
+    global players, game_winner, race_positions, WIRE_FORMAT, my_player_id
+    if kind == protocol.MSG_HELLO:
+        # The server confirms the wire format and room and tells us our player id
+        hello = protocol.decode_hello(payload)
+        WIRE_FORMAT, my_player_id = hello.format, hello.player_id
+        print(f"Joined room '{hello.room}' as player {my_player_id}")
+        if hello.flags & protocol.HELLO_UDP:
+            open_udp_channel(hello.token, hello.udp_port or SERVER_PORT)
+    elif kind == protocol.MSG_SNAPSHOT:
+        players = protocol.decode_players(payload)
+        remote_cars.push(players, time.monotonic())
+    elif kind == protocol.MSG_DELTA:
+        received = delta_receiver.receive(payload)
+        if received is not None:
+            players, changed = received
+            # Distant cars are held between refreshes (see interest.py): an
+            # unchanged car is only a new sample on its refresh ticks
+            tick = delta_receiver.last_tick
+            sampled = {player_id for player_id in players
+                       if player_id in changed or interest.refresh_due(tick, player_id)}
+            remote_cars.push(players, time.monotonic(), sampled)
+    elif kind == protocol.MSG_POSITIONS:
+        race_positions = protocol.decode_positions(payload)
+    elif kind == protocol.MSG_JSON:
+        response = protocol.decode_json(payload)
+        if "players" in response:
+            players = response["players"]
+            remote_cars.push(players, time.monotonic())
+        if "winner" in response:
+            game_winner = response["winner"]
+            race_positions = response.get("positions", [])
+        elif "positions" in response:
+            race_positions = response["positions"]
 
-# Modify the receive_data function to handle game end
 def receive_data(sock):
-    global players, game_winner, race_positions, game_finished
-    buffer = ""
+    decoder = protocol.FrameDecoder()
     while True:
         try:
             data = sock.recv(4096)
             if not data:
                 break
-            
-            try:
-                buffer += data.decode()
-                while buffer:
-                    try:
-                        response = json.loads(buffer)
-                        if "players" in response:
-                            players = response["players"]
-                        if "winner" in response:
-                            game_winner = response["winner"]
-                            race_positions = response.get("positions", [])
-                            game_finished = True
-                        buffer = ""
-                        break
-                    except json.JSONDecodeError as e:
-                        if "Extra data" in str(e):
-                            # Try to find the end of the first complete JSON object
-                            pos = buffer.find("}")
-                            if pos != -1:
-                                first_json = buffer[:pos+1]
-                                buffer = buffer[pos+1:]
-                                try:
-                                    response = json.loads(first_json)
-                                    if "players" in response:
-                                        players = response["players"]
-                                except:
-                                    buffer = ""
-                            else:
-                                buffer = ""
-                        else:
-                            buffer = ""
-                            break
-                        
-            except UnicodeDecodeError:
-                buffer = ""
-                continue
-                
+
+            for kind, payload in decoder.feed(data):
+                try:
+                    handle_message(kind, payload)
+                except protocol.DECODE_ERRORS as e:
+                    print(f"Bad message from server: {e}")
+
         except Exception as e:
             print(f"Connection error: {e}")
             break
 
+def receive_datagrams(sock, token):
+    last_sequence = 0
+    while True:
+        try:
+            data = sock.recv(65535)
+            player_id, data_token, sequence, frames = protocol.decode_datagram(data)
+            if data_token != token or sequence <= last_sequence:
+                continue  # Not ours, duplicated or older than what we already have
+            last_sequence = sequence
+            for kind, payload in frames:
+                handle_message(kind, payload)
+        except protocol.DECODE_ERRORS as e:
+            print(f"Bad datagram from server: {e}")
+        except Exception as e:
+            print(f"UDP error: {e}")
+            break
+
+def open_udp_channel(token, port):
+    global udp_socket, udp_token
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect((SERVER_IP, port))
+    udp_token = token
+    threading.Thread(target=receive_datagrams, args=(sock, token), daemon=True).start()
+    udp_socket = sock
+
+def send_state(player_data, reliable):
+    """Runs on the sender thread: positions over UDP when available, reliable events over TCP"""
+    global acked_tick, udp_sequence
+    message = protocol.encode_state(player_data, WIRE_FORMAT)
+    # Acknowledge the newest snapshot so the server can delta against it
+    if delta_receiver.last_tick != acked_tick:
+        acked_tick = delta_receiver.last_tick
+        message += protocol.encode_ack(acked_tick)
+    if udp_socket is not None and not reliable:
+        udp_sequence += 1
+        udp_socket.send(protocol.encode_datagram(my_player_id, udp_token, udp_sequence, message))
+    else:
+        client_socket.sendall(message)
+
 threading.Thread(target=receive_data, args=(client_socket,), daemon=True).start()
+# El bucle de render solo deja el estado; el envío ocurre en otro hilo
+state_sender = sender.StateSender(send_state, SEND_RATE) if connected else None
 
 # ----------------------------------------------------------------
 #                   SISTEMA DE LAPS
 # ----------------------------------------------------------------
-lap_count = 0
-max_laps = 3
-current_checkpoint_index = 0
-checkpoint_hit = False
-lap_times = []
-game_finished = False
-total_time = 0
+# Vueltas, checkpoints y tiempos se guardan en el estado del coche; la
+# carrera termina para nosotros con player_car.finished, no cuando otro gana
 
 # ----------------------------------------------------------------
 #                   CREAR COCHE
 # ----------------------------------------------------------------
-player_car = Car(start_position[0], start_position[1])
-player_car.angle = 90
+player_car = simulation.CarState(start_position[0], start_position[1], now=time.time())
+
+# ----------------------------------------------------------------
+#                   COCHE FANTASMA
+# ----------------------------------------------------------------
+# Cada vuelta se graba en buffers preasignados; la mejor (también de
+# partidas anteriores, guardada en disco) se dibuja translúcida.
+lap_recorder = ghost.LapRecorder()
+ghost_track = ghost.track_id(world)
+try:
+    best_ghost = ghost.Ghost.load(ghost.GHOST_FILE, ghost_track)
+    print(f"Ghost loaded: best lap {best_ghost.lap_time:.2f}s")
+except FileNotFoundError:
+    best_ghost = None
+except (OSError, ValueError) as e:
+    print(f"Ignoring ghost file: {e}")
+    best_ghost = None
 
 # ----------------------------------------------------------------
 #                   PYGAME DISPLAY
@@ -282,338 +339,244 @@ screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 pygame.display.set_caption("RACING GAME: VELOCITY UNLEASHED")
 pygame.display.set_icon(bomb_image)  # Set window icon
 clock = pygame.time.Clock()
+frame_profiler = profiling.FrameProfiler()  # Tiempo de cada etapa del frame (ver benchmark.py)
+car_atlas = render.SpriteAtlas(car_images, CAR_ROTATION_STEP)
+dirty = render.DirtyRects(DIRTY_RECTS)  # Zonas dibujadas sobre la capa estática
+ghost_atlas = render.SpriteAtlas({'ghost': car_images['blue']}, CAR_ROTATION_STEP, alpha=GHOST_ALPHA)
+
+# Caja del HUD con sus títulos fijos (LAP / CURRENT / BEST)
+ui_box_width = 320
+ui_box_height = 80
+hud_box = pygame.Surface((ui_box_width, ui_box_height), pygame.SRCALPHA)
+hud_box.fill(UI_BG)
+pygame.draw.rect(hud_box, UI_BORDER, (0, 0, ui_box_width, ui_box_height), 2)
+# All three titles in the same row with bold text, positioned evenly
+hud_box.blit(label_font.render("LAP", True, TEXT_COLOR), (30, 10))
+hud_box.blit(label_font.render("CURRENT", True, TEXT_COLOR), (120, 10))
+hud_box.blit(label_font.render("BEST", True, TEXT_COLOR), (230, 10))
 
 running = True
 while running:
     clock.tick(FPS)
+    frame_profiler.start_frame()
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
+        elif event.type == pygame.VIDEORESIZE:
+            static_layer.invalidate()
+            dirty.invalidate()
+    frame_profiler.mark("events")
 
-    # 1. Dibujar fondo con degradado
-    background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-    draw_vertical_gradient(background, BG_TOP, BG_BOTTOM)
-    screen.blit(background, (0, 0))
-
-    # 2. Dibujar la pista (incluyendo césped y bordes)
-    screen.blit(track_surface, (0, 0))
+    # 1-5. Fondo, pista, header, título, meta y bombas pre-renderizados
+    # (con DIRTY_RECTS solo donde se dibujó en el frame anterior)
+    dirty.restore(screen, static_layer.get(screen.get_size()))
+    frame_profiler.mark("background")
 
-    # 3. Header semitransparente
-    header_surface = pygame.Surface((SCREEN_WIDTH, offset_y), pygame.SRCALPHA)
-    header_surface.fill((0, 0, 0, 180))  # Made slightly more opaque
-    screen.blit(header_surface, (0, 0))
-
-    # 4. Título centrado
-    title_str = "RACING GAME: VELOCITY UNLEASHED"
-    # Changed from TITLE_COLOR to a bright white with slight blue tint
-    title_surf = title_font.render(title_str, True, (240, 250, 255))
-    title_rect = title_surf.get_rect(center=(SCREEN_WIDTH // 2, offset_y // 2))
-    screen.blit(title_surf, title_rect)
-
-    # 5. Dibujar bombas
-    for bomb in bombs:
-        bomb_rect = bomb_image.get_rect(center=bomb.center)
-        screen.blit(bomb_image, bomb_rect)
-
-    # 6. Controles del coche
+    # 6-7. Controles y física del coche; 9-10. checkpoints, meta y bombas
     keys = pygame.key.get_pressed()
-    if keys[pygame.K_LEFT]:
-        player_car.angle += TURNING_SPEED * 1.2
-    if keys[pygame.K_RIGHT]:
-        player_car.angle -= TURNING_SPEED * 1.2
-    if keys[pygame.K_UP]:
-        player_car.acceleration_time += 1/FPS
-        acceleration = ACCELERATION * min(player_car.acceleration_time, 3.0)
-        player_car.speed = min(player_car.speed + acceleration, MAX_SPEED)
-    elif keys[pygame.K_DOWN]:
-        player_car.acceleration_time += 1/FPS
-        deceleration = ACCELERATION * min(player_car.acceleration_time, 2.0)
-        player_car.speed = max(player_car.speed - deceleration, -MAX_SPEED / 2.5)
-    else:
-        player_car.acceleration_time = 0
-        player_car.speed *= (1 - FRICTION * 1.5)
-
-    # 7. Aplicar física de pista/césped
-    on_track = is_on_track(player_car.position, CAR_WIDTH, CAR_HEIGHT, player_car.angle)
-    if on_track:
-        player_car.speed *= (1 - FRICTION)
-    else:
-        player_car.speed *= (1 - FRICTION - GRASS_SLOWDOWN)
-
-    # Actualizar posición
-    angle_rad = math.radians(player_car.angle)
-    player_car.velocity[0] = math.sin(angle_rad) * player_car.speed
-    player_car.velocity[1] = math.cos(angle_rad) * player_car.speed
-    player_car.position[0] += player_car.velocity[0]
-    player_car.position[1] += player_car.velocity[1]
-
-    # Limitar a la pantalla
-    player_car.position[0] = max(0, min(player_car.position[0], SCREEN_WIDTH))
-    player_car.position[1] = max(0, min(player_car.position[1], SCREEN_HEIGHT))
-
-    # 8. Dibujar línea de meta y checkpoints
-    for i in range(10):
-        c = BLACK if i % 2 == 0 else WHITE
-        pygame.draw.rect(screen, c, (finish_line.x + i*10, finish_line.y, 10, finish_line.height))
-
+    inputs = simulation.Inputs(keys[pygame.K_LEFT], keys[pygame.K_RIGHT], keys[pygame.K_UP], keys[pygame.K_DOWN])
+    for event_kind, value in simulation.step(player_car, inputs, 1 / FPS, world, clock=time.time):
+        if event_kind == simulation.EVENT_CHECKPOINT:
+            print(f"Checkpoint {value} reached!")
+        elif event_kind == simulation.EVENT_LAP:
+            print(f"Lap {player_car.lap_count} completed in {value:.2f} seconds!")
+            lap = lap_recorder.finish(value)
+            # Ghosts are replayed frame by frame, so the best one is the shortest in frames
+            if lap is not None and (best_ghost is None or len(lap) < len(best_ghost)):
+                best_ghost = lap
+                try:
+                    best_ghost.save(ghost.GHOST_FILE, ghost_track)
+                except OSError as e:
+                    print(f"Could not save ghost: {e}")
+        elif event_kind == simulation.EVENT_FINISHED:
+            print(f"Race finished! Total time: {value:.2f}s, Best lap: {player_car.best_lap:.2f}s")
+        elif event_kind == simulation.EVENT_BOMB:
+            print("Hit a bomb! Back to start.")
+    if not player_car.finished:
+        lap_recorder.add(player_car.position[0], player_car.position[1], player_car.angle)
+    on_track = player_car.on_track
+    frame_profiler.mark("physics")
+
+    # Choques con otros coches
+    remote_states = remote_cars.states(time.monotonic())
+    for player_id in list(car_grid.keys()):
+        if player_id not in remote_states:
+            car_grid.remove(player_id)
+    for player_id, (other_pos, other_angle) in remote_states.items():
+        if str(player_id) != str(my_player_id):
+            car_grid.move(player_id, simulation.car_rect(other_pos, world.car_size))
+    for player_id in car_grid.query(simulation.car_rect(player_car.position, world.car_size)):
+        tie = 1 if str(my_player_id) > str(player_id) else -1  # Cars on the same spot split apart
+        simulation.push_apart(player_car, remote_states[player_id][0], world, tie)
+    frame_profiler.mark("contacts")
+
+    # 8. Dibujar checkpoints (la línea de meta está en la capa estática)
     for i, checkpoint in enumerate(checkpoints):
-        color = GREEN if i < current_checkpoint_index else YELLOW
-        pygame.draw.rect(screen, color, checkpoint, 3)
-        num_surf = font.render(str(i+1), True, color)
+        color = GREEN if i < player_car.checkpoint_index else YELLOW
+        dirty.add(pygame.draw.rect(screen, color, checkpoint, 3))
+        num_surf = text_cache.render(font, str(i+1), color)
         # Get the text size to center it properly
         text_rect = num_surf.get_rect()
         text_rect.center = checkpoint.center
-        screen.blit(num_surf, text_rect)
-
-    # 9. Rect del coche para colisiones
-    player_rect = pygame.Rect(
-        player_car.position[0] - CAR_WIDTH/2,
-        player_car.position[1] - CAR_HEIGHT/2,
-        CAR_WIDTH,
-        CAR_HEIGHT
-    )
-
-    # Checkpoints
-    if current_checkpoint_index < len(checkpoints):
-        checkpoint = checkpoints[current_checkpoint_index]
-        if player_rect.colliderect(checkpoint):
-            if not checkpoint_hit:
-                checkpoint_hit = True
-                current_checkpoint_index += 1
-                print(f"Checkpoint {current_checkpoint_index} reached!")
-        else:
-            checkpoint_hit = False
-
-    # Meta
-    if current_checkpoint_index >= len(checkpoints) and player_rect.colliderect(finish_line):
-        lap_count += 1
-        current_lap_time = time.time() - player_car.current_lap_start
-        player_car.last_lap_time = current_lap_time
-        lap_times.append(current_lap_time)
-
-        if current_lap_time < player_car.best_lap:
-            player_car.best_lap = current_lap_time
-
-        print(f"Lap {lap_count} completed in {current_lap_time:.2f} seconds!")
-        current_checkpoint_index = 0
-        player_car.current_lap_start = time.time()
-
-        if lap_count >= max_laps:
-            game_finished = True
-            total_time = sum(lap_times)
-            player_car.speed = 0
-            print(f"Race finished! Total time: {total_time:.2f}s, Best lap: {player_car.best_lap:.2f}s")
-
-    # 10. Colisión con bombas y explosión
-    current_time = time.time()
-    for bomb in bombs:
-        if player_rect.colliderect(bomb) and explosion_pos is None:
-            player_car.speed = 0
-            player_car.position = start_position.copy()
-            player_car.angle = 90
-            explosion_pos = bomb.center
-            explosion_start = current_time
-            print("Hit a bomb! Back to start.")
+        dirty.add(screen.blit(num_surf, text_rect))
 
-    if explosion_pos is not None:
-        if current_time - explosion_start < EXPLOSION_DURATION:
-            exp_rect = explosion_image.get_rect(center=explosion_pos)
-            screen.blit(explosion_image, exp_rect)
-        else:
-            explosion_pos = None
+    frame_profiler.mark("checkpoints")
+
+    # Explosión
+    if player_car.explosion_pos is not None:
+        if time.time() - player_car.explosion_start < simulation.EXPLOSION_DURATION:
+            exp_rect = explosion_image.get_rect(center=player_car.explosion_pos)
+            dirty.add(screen.blit(explosion_image, exp_rect))
+
+    # Coche fantasma: la mejor vuelta, en el mismo frame de la vuelta actual
+    if best_ghost is not None and not player_car.finished:
+        sample = best_ghost.sample(lap_recorder.count - 1)
+        if sample is not None:
+            ghost_car, ghost_rect = ghost_atlas.get('ghost', sample[1], sample[0])
+            dirty.add(screen.blit(ghost_car, ghost_rect))
+    frame_profiler.mark("ghost")
 
     # 11. Dibujar el coche
-    car_surf = pygame.Surface((CAR_WIDTH, CAR_HEIGHT), pygame.SRCALPHA)
-    pygame.draw.rect(car_surf, BLUE, (0, 0, CAR_WIDTH, CAR_HEIGHT))
-    pygame.draw.polygon(car_surf, RED, [
-        (CAR_WIDTH-5, CAR_HEIGHT//2),
-        (CAR_WIDTH, CAR_HEIGHT//2-5),
-        (CAR_WIDTH, CAR_HEIGHT//2+5)
-    ])
-    # Move this to the image loading section at the top of the file
-    car_images = {
-        'blue': pygame.transform.rotate(pygame.transform.scale(pygame.image.load('car_blue.png'), (CAR_WIDTH, CAR_HEIGHT)), 270),
-        'red': pygame.transform.rotate(pygame.transform.scale(pygame.image.load('car_red.png'), (CAR_WIDTH, CAR_HEIGHT)), 270),
-        'green': pygame.transform.rotate(pygame.transform.scale(pygame.image.load('car_green.png'), (CAR_WIDTH, CAR_HEIGHT)), 270),
-        'yellow': pygame.transform.rotate(pygame.transform.scale(pygame.image.load('car_yellow.png'), (CAR_WIDTH, CAR_HEIGHT)), 270),
-    }
-    
-    PLAYER_COLORS = ['blue', 'red', 'green', 'yellow']
-    rotated_car = pygame.transform.rotate(car_images['blue'], player_car.angle)
-    car_rect = rotated_car.get_rect(center=player_car.position)
-    screen.blit(rotated_car, car_rect)
+    rotated_car, car_rect = car_atlas.get('blue', player_car.angle, player_car.position)
+    dirty.add(screen.blit(rotated_car, car_rect))
+    frame_profiler.mark("car")
 
     # Draw other players
     for player_id, player_data in players.items():
-        if str(player_id) != str(player_car.id):
+        if str(player_id) != str(my_player_id):
             try:
-                other_pos = player_data["position"]
-                other_angle = player_data["angle"]
+                other_pos, other_angle = remote_states[player_id]
                 
                 # Get color based on player_id
                 color_index = (int(player_id) - 1) % len(PLAYER_COLORS)
                 player_color = PLAYER_COLORS[color_index]
                 
                 # Draw other player's car with their color
-                other_car = pygame.transform.rotate(car_images[player_color], other_angle)
-                other_rect = other_car.get_rect(center=other_pos)
-                screen.blit(other_car, other_rect)
+                other_car, other_rect = car_atlas.get(player_color, other_angle, other_pos)
+                dirty.add(screen.blit(other_car, other_rect))
                 
                 # Draw player ID and lap info with matching color
                 player_info = f"P{player_id} - Lap {player_data.get('lap', 0)}"
-                player_label = font.render(player_info, True, player_color)
+                player_label = text_cache.render(font, player_info, player_color)
                 label_rect = player_label.get_rect(center=(other_pos[0], other_pos[1] - 30))
-                screen.blit(player_label, label_rect)
+                dirty.add(screen.blit(player_label, label_rect))
             except (KeyError, TypeError):
                 continue
+    frame_profiler.mark("remote_cars")
 
     # 12. UI BOX (más pequeña)
-    ui_box_width = 320
-    ui_box_height = 80
     ui_box_x = 10
     ui_box_y = SCREEN_HEIGHT - ui_box_height - 10
 
-    ui_surface = pygame.Surface((ui_box_width, ui_box_height), pygame.SRCALPHA)
-    ui_surface.fill(UI_BG)
-    pygame.draw.rect(ui_surface, UI_BORDER, (0, 0, ui_box_width, ui_box_height), 2)
-    
-    # All three titles in the same row with bold text
-    label_lap = pygame.font.SysFont("Arial", 18, bold=True).render("LAP", True, TEXT_COLOR)
-    label_current = pygame.font.SysFont("Arial", 18, bold=True).render("CURRENT", True, TEXT_COLOR)
-    label_best = pygame.font.SysFont("Arial", 18, bold=True).render("BEST", True, TEXT_COLOR)
-    
-    # Position the three titles evenly
-    ui_surface.blit(label_lap, (30, 10))
-    ui_surface.blit(label_current, (120, 10))
-    ui_surface.blit(label_best, (230, 10))
-    
-    # Values below their respective titles
-    lap_text = title_font.render(f"{lap_count}/{max_laps}", True, ACCENT_COLOR)
+    # Fondo, borde y títulos fijos de la caja, pre-renderizados
+    dirty.add(screen.blit(hud_box, (ui_box_x, ui_box_y)))
+
+    # Values below their respective titles (only re-rendered when they change)
+    lap_text = text_cache.render(title_font, f"{player_car.lap_count}/{world.max_laps}", ACCENT_COLOR)
     time_val = time.time() - player_car.current_lap_start
-    current_lap_text = data_font.render(f"{time_val:.2f}s", True, WHITE)
+    current_lap_text = text_cache.render(data_font, f"{time_val:.2f}s", WHITE)
     best_lap_val = player_car.best_lap if player_car.best_lap != float('inf') else 0
-    best_lap_text = data_font.render(f"{best_lap_val:.2f}s", True, GOLD)
+    best_lap_text = text_cache.render(data_font, f"{best_lap_val:.2f}s", GOLD)
     
-    # Position the values below their titles
-    ui_surface.blit(lap_text, (30, 40))
-    ui_surface.blit(current_lap_text, (120, 40))
-    ui_surface.blit(best_lap_text, (230, 40))
-
-    screen.blit(ui_surface, (ui_box_x, ui_box_y))
+    # Position the values below their titles (inside the box's dirty rect)
+    screen.blit(lap_text, (ui_box_x + 30, ui_box_y + 40))
+    screen.blit(current_lap_text, (ui_box_x + 120, ui_box_y + 40))
+    screen.blit(best_lap_text, (ui_box_x + 230, ui_box_y + 40))
 
     # Indicador ON/OFF TRACK
-    status_txt = font.render("ON TRACK" if on_track else "OFF TRACK", True, GREEN if on_track else RED)
-    screen.blit(status_txt, (SCREEN_WIDTH - 150, offset_y + 10))
+    status_txt = text_cache.render(font, "ON TRACK" if on_track else "OFF TRACK", GREEN if on_track else RED)
+    dirty.add(screen.blit(status_txt, (SCREEN_WIDTH - 150, offset_y + 10)))
+
+    # Posición en carrera y ganador, según el servidor
+    positions = race_positions  # Replaced whole by the network thread
+    if my_player_id in positions and not player_car.finished:
+        pos_txt = text_cache.render(font, f"POS {positions.index(my_player_id) + 1}/{len(positions)}", WHITE)
+        dirty.add(screen.blit(pos_txt, (SCREEN_WIDTH - 150, offset_y + 35)))
+    if game_winner is not None and not player_car.finished:
+        winner_txt = text_cache.render(font, f"Player {game_winner} won!", GOLD)
+        dirty.add(screen.blit(winner_txt, (SCREEN_WIDTH - 150, offset_y + 60)))
+    frame_profiler.mark("hud")
 
     # 13. Leaderboard si terminó la carrera
-    if game_finished:
-        lb_surf = pygame.Surface((360, 280), pygame.SRCALPHA)
+    if player_car.finished:
+        lb_surf = pygame.Surface((460, 300), pygame.SRCALPHA)
         lb_surf.fill((0, 0, 0, 160))
-        pygame.draw.rect(lb_surf, ACCENT_COLOR, (0, 0, 360, 280), 2)
+        pygame.draw.rect(lb_surf, ACCENT_COLOR, (0, 0, 460, 300), 2)
 
-        lb_title = title_font.render("RACE FINISHED!", True, ACCENT_COLOR)
-        lb_title_rect = lb_title.get_rect(center=(180, 30))
+        if game_winner is not None and game_winner == my_player_id:
+            lb_title = text_cache.render(title_font, "YOU WIN!", GOLD)
+        else:
+            lb_title = text_cache.render(title_font, "RACE FINISHED!", ACCENT_COLOR)
+        lb_title_rect = lb_title.get_rect(center=(230, 30))
         lb_surf.blit(lb_title, lb_title_rect)
 
-        total_txt = data_font.render(f"Total Time: {total_time:.2f}s", True, WHITE)
+        total_txt = text_cache.render(data_font, f"Total Time: {player_car.total_time:.2f}s", WHITE)
         lb_surf.blit(total_txt, (20, 70))
 
-        best_txt = data_font.render(f"Best Lap: {player_car.best_lap:.2f}s", True, GOLD)
+        best_txt = text_cache.render(data_font, f"Best Lap: {player_car.best_lap:.2f}s", GOLD)
         lb_surf.blit(best_txt, (20, 100))
 
-        laps_title = data_font.render("Lap Times:", True, WHITE)
+        laps_title = text_cache.render(data_font, "Lap Times:", WHITE)
         lb_surf.blit(laps_title, (20, 140))
 
-        for i, lt in enumerate(lap_times):
-            lt_txt = data_font.render(f"Lap {i+1}: {lt:.2f}s", True, WHITE)
+        for i, lt in enumerate(player_car.lap_times):
+            lt_txt = text_cache.render(data_font, f"Lap {i+1}: {lt:.2f}s", WHITE)
             lb_surf.blit(lt_txt, (40, 165 + i*25))
 
-        exit_txt = data_font.render("Press ESC to exit", True, ACCENT_COLOR)
-        exit_rect = exit_txt.get_rect(center=(180, 250))
+        # Winner and race order, in the right column
+        if game_winner is not None:
+            winner_txt = text_cache.render(data_font, f"Winner: Player {game_winner}", GOLD)
+            lb_surf.blit(winner_txt, (250, 70))
+        if positions:
+            pos_title = text_cache.render(data_font, "Positions:", WHITE)
+            lb_surf.blit(pos_title, (250, 100))
+            for i, player_id in enumerate(positions[:6]):
+                position_txt = text_cache.render(
+                    data_font,
+                    f"{i+1}. Player {player_id}" + (" (You)" if player_id == my_player_id else ""),
+                    GOLD if player_id == game_winner else WHITE)
+                lb_surf.blit(position_txt, (260, 125 + i*22))
+
+        exit_txt = text_cache.render(data_font, "Press ESC to exit", ACCENT_COLOR)
+        exit_rect = exit_txt.get_rect(center=(230, 275))
         lb_surf.blit(exit_txt, exit_rect)
 
         lb_rect = lb_surf.get_rect(center=(SCREEN_WIDTH//2, SCREEN_HEIGHT//2))
-        screen.blit(lb_surf, lb_rect)
+        dirty.add(screen.blit(lb_surf, lb_rect))
 
         # Salir con ESC
         if keys[pygame.K_ESCAPE]:
             running = False
+    frame_profiler.mark("leaderboard")
 
     # ----------------------------------------------------------------
     #                   ACTUALIZAR MULTIJUGADOR
     # ----------------------------------------------------------------
-    player_data = {
-        "position": player_car.position,
-        "angle": player_car.angle,
-        "lap": lap_count,
-        "checkpoints": current_checkpoint_index,
-        "id": player_car.id  # Add this to Car class initialization
-    }
-    try:
-        # Update multiplayer section in game loop
-        message = json.dumps(player_data) + "\n"
-        client_socket.sendall(message.encode())
-    except:
-        pass
-
-    pygame.display.flip()
+    if state_sender is not None:
+        player_data = {
+            "position": tuple(player_car.position),  # A copy: the sender thread encodes it later
+            "angle": player_car.angle,
+            "lap": player_car.lap_count,
+            "checkpoints": player_car.checkpoint_index,
+            "finished": player_car.finished,
+            "id": my_player_id
+        }
+        state_sender.update(player_data)
+        # Lap and race-finished changes also go over TCP so they are never lost
+        reliable_state = (player_car.lap_count, player_car.finished)
+        if reliable_state != last_reliable_state:
+            state_sender.send_event(player_data)
+            last_reliable_state = reliable_state
+    frame_profiler.mark("network")
+
+    dirty.update(screen)
+    frame_profiler.mark("flip")
+    frame_profiler.end_frame()
 
 pygame.quit()
+if state_sender is not None:
+    state_sender.close()
 try:
     client_socket.close()
 except:
     pass
-
-# Modify the game finish section
-    if game_finished:
-        lb_surf = pygame.Surface((400, 320), pygame.SRCALPHA)
-        lb_surf.fill((0, 0, 0, 180))
-        pygame.draw.rect(lb_surf, ACCENT_COLOR, (0, 0, 400, 320), 2)
-
-        if game_winner == player_car.id:
-            lb_title = title_font.render("YOU WIN!", True, GOLD)
-        else:
-            lb_title = title_font.render("RACE FINISHED!", True, ACCENT_COLOR)
-        lb_title_rect = lb_title.get_rect(center=(200, 30))
-        lb_surf.blit(lb_title, lb_title_rect)
-
-        if game_winner:
-            winner_txt = data_font.render(f"Winner: Player {game_winner}", True, GOLD)
-            lb_surf.blit(winner_txt, (20, 70))
-
-        # Show positions
-        pos_title = data_font.render("Final Positions:", True, WHITE)
-        lb_surf.blit(pos_title, (20, 110))
-
-        for i, player_id in enumerate(race_positions):
-            position_txt = data_font.render(
-                f"{i+1}. Player {player_id}" + (" (You)" if player_id == player_car.id else ""),
-                True,
-                GOLD if player_id == game_winner else WHITE
-            )
-            lb_surf.blit(position_txt, (40, 140 + i*25))
-
-        # Show your stats if you finished
-        if player_car.id == game_winner:
-            total_txt = data_font.render(f"Your Time: {total_time:.2f}s", True, WHITE)
-            lb_surf.blit(total_txt, (20, 220))
-            best_txt = data_font.render(f"Best Lap: {player_car.best_lap:.2f}s", True, GOLD)
-            lb_surf.blit(best_txt, (20, 250))
-
-        exit_txt = data_font.render("Press ESC to exit", True, ACCENT_COLOR)
-        exit_rect = exit_txt.get_rect(center=(200, 290))
-        lb_surf.blit(exit_txt, exit_rect)
-
-        lb_rect = lb_surf.get_rect(center=(SCREEN_WIDTH//2, SCREEN_HEIGHT//2))
-        screen.blit(lb_surf, lb_rect)
-
-# Modify the multiplayer update section to include game finish
-    player_data = {
-        "position": player_car.position,
-        "angle": player_car.angle,
-        "lap": lap_count,
-        "checkpoints": current_checkpoint_index,
-        "id": player_car.id,
-        "finished": game_finished,
-        "total_time": total_time if game_finished else 0
-    }
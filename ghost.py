@@ -0,0 +1,112 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import protocol
+
+# ----------------------------------------------------------------
+#                   COCHE FANTASMA
+# ----------------------------------------------------------------
+# The client records every lap's trajectory (position and angle per frame)
+# into buffers allocated once, keeps the fastest lap as a Ghost and draws it
+# as a translucent car in later laps, indexed by frames since the lap
+# started. The best ghost is saved as a small header plus one uint16
+# triplet per frame (same quantization as the network protocol) and loaded
+# back with a single read.
+
+MAGIC = b"GHST"
+VERSION = 1
+HEADER = struct.Struct("<4sHIIf")  # magic, version, track id, frame count, lap time
+MAX_LAP_FRAMES = 60 * 180          # Three minutes at 60 FPS; longer laps are not kept
+GHOST_FILE = "best_lap.ghost"
+
+
+def track_id(world):
+    """Checksum of the layout a ghost was driven on, so it is not replayed on another track"""
+    layout = (world.checkpoints, world.finish_line, world.bombs, world.start_position, world.size)
+    return zlib.crc32(repr(layout).encode("utf-8"))
+
+
+class Ghost:
+    """One lap's trajectory: per-frame x, y and angle"""
+
+    def __init__(self, xs, ys, angles, lap_time):
+        self.xs = xs
+        self.ys = ys
+        self.angles = angles
+        self.lap_time = lap_time
+
+    def __len__(self):
+        return len(self.xs)
+
+    def sample(self, frame):
+        """((x, y), angle) at frame since the lap started, or None past the end"""
+        if 0 <= frame < len(self.xs):
+            return (float(self.xs[frame]), float(self.ys[frame])), float(self.angles[frame])
+        return None
+
+    def save(self, path, track):
+        """Write atomically, so a crash never leaves a half-written ghost"""
+        frames = np.empty((len(self.xs), 3), dtype="<u2")
+        frames[:, 0] = np.clip(np.rint(self.xs * protocol.POSITION_SCALE), 0, 0xFFFF)
+        frames[:, 1] = np.clip(np.rint(self.ys * protocol.POSITION_SCALE), 0, 0xFFFF)
+        frames[:, 2] = np.rint(np.mod(self.angles, 360.0) * protocol.ANGLE_SCALE).astype(np.int64) & 0xFFFF
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, track, len(frames), self.lap_time))
+            f.write(frames.tobytes())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path, track):
+        """Read a saved ghost; raises ValueError if it is not a ghost for this track"""
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ValueError(f"{path}: not a ghost file")
+        magic, version, saved_track, count, lap_time = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a version {VERSION} ghost file")
+        if saved_track != track:
+            raise ValueError(f"{path}: recorded on a different track")
+        frames = np.frombuffer(data, dtype="<u2", count=count * 3, offset=HEADER.size).reshape(count, 3)
+        frames = frames.astype(np.float32)
+        return cls(frames[:, 0] / protocol.POSITION_SCALE, frames[:, 1] / protocol.POSITION_SCALE,
+                   frames[:, 2] / np.float32(protocol.ANGLE_SCALE), lap_time)
+
+
+class LapRecorder:
+    """Trajectory of the lap in progress, in buffers allocated once"""
+
+    def __init__(self, capacity=MAX_LAP_FRAMES):
+        self.xs = np.zeros(capacity, dtype=np.float32)
+        self.ys = np.zeros(capacity, dtype=np.float32)
+        self.angles = np.zeros(capacity, dtype=np.float32)
+        self.count = 0
+        self.overflow = False
+
+    def start(self):
+        self.count = 0
+        self.overflow = False
+
+    def add(self, x, y, angle):
+        """Store one frame; no allocation, just three scalar writes"""
+        i = self.count
+        if i < len(self.xs):
+            self.xs[i] = x
+            self.ys[i] = y
+            self.angles[i] = angle
+            self.count = i + 1
+        else:
+            self.overflow = True
+
+    def finish(self, lap_time):
+        """Return the lap as a Ghost (None if it did not fit) and start the next one"""
+        lap = None
+        if not self.overflow and self.count:
+            n = self.count
+            lap = Ghost(self.xs[:n].copy(), self.ys[:n].copy(), self.angles[:n].copy(), lap_time)
+        self.start()
+        return lap
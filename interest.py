@@ -0,0 +1,114 @@
+import protocol
+import snapshots
+import spatial
+
+# ----------------------------------------------------------------
+#                   ÁREA DE INTERÉS
+# ----------------------------------------------------------------
+# Each binary client gets its own view of the room's snapshot: cars in the
+# 3x3 block of INTEREST_CELL cells around its own car, the race leaders
+# (for the HUD) and any car whose lap, checkpoint or flags changed are sent
+# every tick; the rest keep the state the client last received and are
+# refreshed every DISTANT_EVERY ticks, staggered by player id (refresh_due).
+# Delta encoding turns those held entries into zero bytes, so what a client
+# downloads depends on the cars around it rather than on the size of the
+# field. The neighbourhood is looked up once per cell and tick, and shared
+# by the clients in that cell.
+#
+# A held entry is not a new position: clients only take a car that did not
+# change as an interpolation sample on its refresh ticks.
+#
+# Views are kept per client as delta baselines. When every car is relevant
+# to a client (rooms with fewer than MIN_PLAYERS cars, or a field bunched
+# up) its view is the room snapshot itself and the encoding stays shared.
+
+INTEREST_CELL = 200    # Pixels; cars within one cell of the client's cell get the full tick rate
+DISTANT_EVERY = 3      # Ticks between updates of the other cars (10 Hz at 30 Hz)
+LEADERS = 3            # Top cars always sent at the full rate
+MIN_PLAYERS = 8        # Smaller rooms send everyone every tick
+
+
+def refresh_due(tick, player_id, every=DISTANT_EVERY):
+    """Whether a car outside a view's interest is re-sent at this tick"""
+    return (tick + player_id) % every == 0
+
+def _position(fields):
+    return protocol.dequantize_position(fields[0]), protocol.dequantize_position(fields[1])
+
+
+class InterestManager:
+    """Per-client filtered views of a room's snapshots"""
+
+    def __init__(self, cell_size=INTEREST_CELL, distant_every=DISTANT_EVERY, leaders=LEADERS,
+                 min_players=MIN_PLAYERS):
+        self.cell_size = cell_size
+        self.distant_every = distant_every
+        self.leaders = leaders
+        self.min_players = min_players
+        self.grid = spatial.SpatialHash(cell_size)
+        self.previous = {}
+        self.fresh = set()  # Cars every view gets this tick: leaders, status changes, refreshes due
+        self.neighbourhoods = {}  # Cell -> cars sent at the full rate to viewers in it, this tick
+        self.filtering = False
+        self.histories = {}  # Viewer player id -> SnapshotHistory of the views it was sent
+
+    def update(self, tick, snapshot, leaders):
+        """Index the tick's car positions and pick the cars everyone gets; call before view()
+
+        leaders are the ids of the leading cars still racing (see standings.py).
+        """
+        previous, self.previous = self.previous, snapshot
+        self.neighbourhoods.clear()
+        self.filtering = len(snapshot) >= self.min_players
+        if not self.filtering:
+            return
+        for player_id in [key for key in self.grid.keys() if key not in snapshot]:
+            self.grid.remove(player_id)
+        fresh = set()
+        for player_id, fields in snapshot.items():
+            x, y = _position(fields)
+            self.grid.move(player_id, (x, y, 1, 1))
+            old = previous.get(player_id)
+            if old is None or old[3:] != fields[3:] or refresh_due(tick, player_id, self.distant_every):
+                fresh.add(player_id)
+        fresh.update(player_id for player_id in leaders if player_id in snapshot)
+        self.fresh = fresh
+
+    def history(self, viewer):
+        history = self.histories.get(viewer)
+        if history is None:
+            history = self.histories[viewer] = snapshots.SnapshotHistory()
+        return history
+
+    def forget(self, viewer):
+        self.histories.pop(viewer, None)
+
+    def view(self, tick, viewer, snapshot):
+        """The snapshot as sent to viewer this tick, stored as a possible baseline"""
+        history = self.history(viewer)
+        previous = history.get(tick - 1)
+        own = snapshot.get(viewer)
+        send = None
+        if self.filtering and previous is not None and own is not None:
+            x, y = _position(own)
+            size = self.cell_size
+            cell = (int(x // size), int(y // size))
+            send = self.neighbourhoods.get(cell)
+            if send is None:
+                block = ((cell[0] - 1) * size, (cell[1] - 1) * size, 3 * size, 3 * size)
+                send = self.neighbourhoods[cell] = self.fresh.union(self.grid.query(block))
+            joined = snapshot.keys() - previous.keys()
+            if joined:
+                send = send | joined
+        if send is None or len(send) == len(snapshot):
+            # Everyone is relevant (a small room, or the whole field bunched
+            # up): the shared snapshot keeps the encoding shared too
+            view = snapshot
+        else:
+            view = dict(previous)
+            for player_id in previous.keys() - snapshot.keys():
+                del view[player_id]
+            for player_id in send:
+                view[player_id] = snapshot[player_id]
+        history.add(tick, view)
+        return view
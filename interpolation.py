@@ -0,0 +1,116 @@
+import threading
+from collections import deque
+
+# ----------------------------------------------------------------
+#                   INTERPOLACIÓN DE COCHES REMOTOS
+# ----------------------------------------------------------------
+# Remote cars are drawn slightly in the past (INTERPOLATION_DELAY) so there
+# are usually two received snapshots around the render time to blend
+# between. When the newest snapshot is too old the car is dead-reckoned
+# forward for at most MAX_EXTRAPOLATION seconds, limited by the same speed
+# and turning constants the local car uses.
+
+INTERPOLATION_DELAY = 0.1   # Seconds behind the newest snapshot
+MAX_EXTRAPOLATION = 0.25    # Seconds of dead reckoning before the car freezes
+BUFFER_SIZE = 32            # Snapshots kept per remote car
+
+
+def angle_difference(a, b):
+    """Shortest signed rotation from angle a to angle b, in degrees"""
+    return (b - a + 180.0) % 360.0 - 180.0
+
+def _clamp(value, limit):
+    return max(-limit, min(limit, value))
+
+
+class SnapshotInterpolator:
+    """Per-remote-player timestamped snapshot buffers.
+
+    push() is called from the network thread and states() from the render
+    loop, so both go through a lock.
+    """
+
+    def __init__(self, max_speed, turning_speed, fps,
+                 delay=INTERPOLATION_DELAY, max_extrapolation=MAX_EXTRAPOLATION,
+                 buffer_size=BUFFER_SIZE):
+        # Physics limits are per frame; convert them to per second
+        self.max_speed = max_speed * fps
+        self.max_turn_rate = turning_speed * fps
+        self.delay = delay
+        self.max_extrapolation = max_extrapolation
+        self.buffer_size = buffer_size
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def push(self, players, timestamp, sampled=None):
+        """Record a received player table ({id: state dict}) at the given time
+
+        sampled limits the new samples to those player ids; the others keep
+        their buffers as they are (None samples everyone).
+        """
+        with self.lock:
+            for player_id in list(self.buffers):
+                if player_id not in players:
+                    del self.buffers[player_id]
+            for player_id, data in players.items():
+                if sampled is not None and player_id not in sampled:
+                    continue
+                try:
+                    x, y = data["position"]
+                    angle = data["angle"]
+                except (KeyError, TypeError, ValueError):
+                    continue
+                buffer = self.buffers.get(player_id)
+                if buffer is None:
+                    buffer = self.buffers[player_id] = deque(maxlen=self.buffer_size)
+                elif buffer[-1][0] >= timestamp:
+                    continue
+                buffer.append((timestamp, x, y, angle))
+
+    def states(self, now):
+        """Return {player_id: ((x, y), angle)} for the render time now - delay"""
+        render_time = now - self.delay
+        with self.lock:
+            return {player_id: self._sample(buffer, render_time)
+                    for player_id, buffer in self.buffers.items()}
+
+    def _sample(self, buffer, render_time):
+        newest = buffer[-1]
+        if render_time >= newest[0]:
+            return self._extrapolate(buffer, render_time)
+        oldest = buffer[0]
+        if render_time <= oldest[0]:
+            return (oldest[1], oldest[2]), oldest[3]
+
+        # Walk back from the newest sample; the render time is almost always
+        # within the last few entries
+        for i in range(len(buffer) - 1, 0, -1):
+            before = buffer[i - 1]
+            if before[0] <= render_time:
+                after = buffer[i]
+                break
+        t = (render_time - before[0]) / (after[0] - before[0])
+        x = before[1] + (after[1] - before[1]) * t
+        y = before[2] + (after[2] - before[2]) * t
+        angle = before[3] + angle_difference(before[3], after[3]) * t
+        return (x, y), angle
+
+    def _extrapolate(self, buffer, render_time):
+        newest = buffer[-1]
+        if len(buffer) < 2:
+            return (newest[1], newest[2]), newest[3]
+        previous = buffer[-2]
+        dt = newest[0] - previous[0]
+        ahead = min(render_time - newest[0], self.max_extrapolation)
+        if dt <= 0 or ahead <= 0:
+            return (newest[1], newest[2]), newest[3]
+
+        vx = (newest[1] - previous[1]) / dt
+        vy = (newest[2] - previous[2]) / dt
+        speed = (vx * vx + vy * vy) ** 0.5
+        if speed > self.max_speed:
+            vx *= self.max_speed / speed
+            vy *= self.max_speed / speed
+        turn_rate = _clamp(angle_difference(previous[3], newest[3]) / dt, self.max_turn_rate)
+        return ((newest[1] + vx * ahead, newest[2] + vy * ahead),
+                newest[3] + turn_rate * ahead)
@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import collections
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+import batch_physics
+import protocol
+import server
+import simulation
+import snapshots
+import track
+
+# ----------------------------------------------------------------
+#                   PRUEBA DE CARGA
+# ----------------------------------------------------------------
+# Headless bots that speak the real protocol: each one joins a room, sends
+# its state (plus the ack of the newest snapshot) at a fixed rate and reads
+# the snapshots back. All bots are driven by one batch_physics.CarBatch, so
+# thousands of them cost a few array operations per send.
+#
+# A handful of "measured" bots fully decode the deltas and time how long it
+# takes for a state they sent to come back in a snapshot (echo latency);
+# the rest only read the tick to acknowledge it. Unless --no-spawn is given
+# the server runs in a child process and every room tick is timed there.
+
+HOST = '127.0.0.1'
+PORT = 5599
+BOTS = 100
+SEND_RATE = 30           # States per second per bot
+DURATION = 20            # Seconds of measurement, after all bots connected
+MEASURED_BOTS = 20       # Bots that decode snapshots to measure echo latency
+CONNECT_CONCURRENCY = 50  # Connections in flight at once (keeps under the listen backlog)
+MAX_WRITE_BUFFER = 64 * 1024  # A bot skips sends while this much is still queued
+PENDING_STATES = 64      # Sent states remembered per measured bot
+
+
+class LoadStats:
+    """Counters shared by all bots"""
+
+    def __init__(self):
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self.received_messages = 0
+        self.received_bytes = 0
+        self.send_stalls = 0
+        self.connect_failures = 0
+        self.dropped = 0
+        self.connected = 0
+        self.echo_latencies = []
+
+    def reset_rates(self):
+        """Forget traffic and latencies from the connection phase"""
+        self.sent_messages = self.sent_bytes = 0
+        self.received_messages = self.received_bytes = 0
+        self.send_stalls = 0
+        self.echo_latencies = []
+
+
+class BotDatagrams(asyncio.DatagramProtocol):
+    """UDP movement stream of one bot"""
+
+    def __init__(self, bot, stats):
+        self.bot = bot
+        self.stats = stats
+
+    def datagram_received(self, data, addr):
+        try:
+            _, token, sequence, frames = protocol.decode_datagram(data)
+        except protocol.DECODE_ERRORS:
+            return
+        if token != self.bot.token or sequence <= self.bot.udp_sequence_in:
+            return
+        self.bot.udp_sequence_in = sequence
+        self.stats.received_bytes += len(data)
+        now = time.perf_counter()
+        for kind, payload in frames:
+            self.bot.handle(kind, payload, now, self.stats)
+
+
+class Bot:
+    """One headless connection"""
+
+    def __init__(self, index, room, measured):
+        self.index = index
+        self.room = room
+        self.reader = None
+        self.writer = None
+        self.udp = None
+        self.player_id = 0
+        self.token = 0
+        self.udp_sequence = 0
+        self.udp_sequence_in = 0
+        self.acked_tick = snapshots.NO_BASELINE
+        self.receiver = snapshots.DeltaReceiver() if measured else None
+        self.pending = collections.OrderedDict()  # state fields -> send time
+        self.connected = False
+
+    async def connect(self, host, port, udp, stats):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        flags = protocol.HELLO_UDP if udp else 0
+        self.writer.write(protocol.encode_hello(protocol.FORMAT_BINARY, flags=flags, room=self.room))
+        kind, payload = await protocol.read_frame(self.reader, server.CLIENT_TIMEOUT)
+        if kind != protocol.MSG_HELLO:
+            raise ValueError(f"expected HELLO, got message kind {kind}")
+        hello = protocol.decode_hello(payload)
+        self.player_id = hello.player_id
+        if hello.flags & protocol.HELLO_UDP:
+            self.token = hello.token
+            loop = asyncio.get_running_loop()
+            self.udp, _ = await loop.create_datagram_endpoint(
+                lambda: BotDatagrams(self, stats), remote_addr=(host, hello.udp_port or port))
+        self.connected = True
+
+    def handle(self, kind, payload, now, stats):
+        stats.received_messages += 1
+        if kind != protocol.MSG_DELTA:
+            return
+        if self.receiver is None:
+            tick = snapshots.DELTA_HEADER.unpack_from(payload)[0]
+            self.acked_tick = max(self.acked_tick, tick)
+            return
+        if self.receiver.receive(payload) is None:
+            return
+        self.acked_tick = self.receiver.last_tick
+        fields = self.receiver.history.get(self.acked_tick).get(self.player_id)
+        sent = self.pending.get(fields)
+        if sent is not None:
+            stats.echo_latencies.append(now - sent)
+            # Older states were overwritten by this one on the server
+            while self.pending.popitem(last=False)[0] != fields:
+                pass
+
+    async def receive(self, stats):
+        try:
+            while True:
+                kind, payload = await protocol.read_frame(self.reader)
+                stats.received_bytes += protocol.HEADER.size + len(payload)
+                self.handle(kind, payload, time.perf_counter(), stats)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            if self.connected:
+                stats.dropped += 1
+            self.connected = False
+
+    def send(self, state, now, stats):
+        message = protocol.encode_state(state)
+        if self.acked_tick != snapshots.NO_BASELINE:
+            message += protocol.encode_ack(self.acked_tick)
+        if self.udp is not None:
+            self.udp_sequence += 1
+            message = protocol.encode_datagram(self.player_id, self.token, self.udp_sequence, message)
+            self.udp.sendto(message)
+        elif self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            stats.send_stalls += 1
+            return
+        else:
+            self.writer.write(message)
+        stats.sent_messages += 1
+        stats.sent_bytes += len(message)
+        if self.receiver is not None:
+            fields = protocol.state_fields(state)
+            self.pending.setdefault(fields, now)
+            if len(self.pending) > PENDING_STATES:
+                self.pending.popitem(last=False)
+
+    def close(self):
+        self.connected = False
+        if self.udp is not None:
+            self.udp.close()
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def connect_all(bots, host, port, udp, stats):
+    limit = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect(bot):
+        async with limit:
+            try:
+                await bot.connect(host, port, udp, stats)
+            except Exception as e:
+                stats.connect_failures += 1
+                if stats.connect_failures <= 5:
+                    print(f"Bot {bot.index} could not connect: {e}")
+
+    await asyncio.gather(*(connect(bot) for bot in bots))
+
+
+async def drive(bots, rate, duration, stats, seed=1):
+    """Step every bot's car and send its state at rate Hz for duration seconds"""
+    world = simulation.default_world()
+    count = len(bots)
+    batch = batch_physics.CarBatch(count, track.start_position)
+    rng = np.random.default_rng(seed)
+    steering = np.zeros(count, dtype=np.int8)  # -1 right, 0 straight, +1 left
+    throttle = np.ones(count, dtype=bool)
+    no_brake = np.zeros(count, dtype=bool)
+    interval = 1.0 / rate
+    next_send = time.perf_counter()
+    end = next_send + duration
+    while next_send < end:
+        change = rng.random(count) < 0.05
+        steering[change] = rng.integers(-1, 2, change.sum())
+        batch_physics.step_batch(batch, steering > 0, steering < 0, throttle, no_brake, interval, world)
+
+        now = time.perf_counter()
+        positions = batch.positions.tolist()
+        angles = batch.angles.tolist()
+        laps = batch.lap_count.tolist()
+        checkpoints = batch.checkpoint_index.tolist()
+        for i, bot in enumerate(bots):
+            if bot.connected:
+                bot.send({"position": positions[i], "angle": angles[i], "lap": laps[i],
+                          "checkpoints": checkpoints[i], "finished": False}, now, stats)
+
+        next_send += interval
+        await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+
+async def run_load(host, port, bots_count, rate, duration, udp, rooms, measured, on_start=None):
+    """Connect the bots, drive them for duration seconds and return (stats, elapsed)"""
+    stats = LoadStats()
+    simulation.default_world()  # Build the track field before the clock starts
+    bots = [Bot(i, f"load-{i % rooms}", i < measured) for i in range(bots_count)]
+    started = time.perf_counter()
+    await connect_all(bots, host, port, udp, stats)
+    connected = [bot for bot in bots if bot.connected]
+    stats.connected = len(connected)
+    print(f"{len(connected)}/{bots_count} bots connected in {time.perf_counter() - started:.1f} s")
+
+    receivers = [asyncio.create_task(bot.receive(stats)) for bot in connected]
+    stats.reset_rates()
+    if on_start is not None:
+        on_start()
+    started = time.perf_counter()
+    try:
+        await drive(connected, rate, duration, stats)
+    finally:
+        elapsed = time.perf_counter() - started
+        for bot in bots:
+            bot.close()
+        for task in receivers:
+            task.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+    return stats, elapsed
+
+
+# ----------------------------------------------------------------
+#                   SERVIDOR EN UN PROCESO HIJO
+# ----------------------------------------------------------------
+
+def serve(conn, host, port, tick_rate, udp, verbose):
+    """Child process: the real server, with every room tick timed"""
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+    durations = []
+    run_tick = server.Room.run_tick
+
+    def timed_run_tick(room):
+        start = time.perf_counter()
+        run_tick(room)
+        durations.append(time.perf_counter() - start)
+
+    server.Room.run_tick = timed_run_tick
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        task = asyncio.create_task(server.main(host, port, tick_rate, udp))
+        await loop.run_in_executor(None, conn.recv)  # Start of the measurement
+        durations.clear()
+        await loop.run_in_executor(None, conn.recv)  # End of the measurement
+        conn.send(durations)
+        task.cancel()
+
+    try:
+        asyncio.run(main())
+    except (asyncio.CancelledError, KeyboardInterrupt):
+        pass
+
+
+# ----------------------------------------------------------------
+#                   INFORME
+# ----------------------------------------------------------------
+
+def format_percentiles(values, scale=1000.0):
+    if not values:
+        return "no samples"
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]) * scale
+    return f"p50 {p50:.2f}  p90 {p90:.2f}  p99 {p99:.2f}  max {max(values) * scale:.2f}  ({len(values)} samples)"
+
+def format_bytes(rate):
+    for unit in ("B", "KB", "MB"):
+        if rate < 1024:
+            return f"{rate:.1f} {unit}/s"
+        rate /= 1024
+    return f"{rate:.1f} GB/s"
+
+def report(stats, elapsed, rate, tick_durations=None):
+    print(f"Sent:      {stats.sent_messages / elapsed:9.0f} msg/s  {format_bytes(stats.sent_bytes / elapsed)}"
+          f"  ({stats.send_stalls} sends skipped on full buffers)")
+    if stats.sent_messages < 0.9 * stats.connected * rate * elapsed:
+        print(f"Warning: the load generator fell behind its target of {stats.connected * rate} msg/s; "
+              "latencies include its own delay")
+    print(f"Received:  {stats.received_messages / elapsed:9.0f} msg/s  {format_bytes(stats.received_bytes / elapsed)}")
+    print(f"Echo latency (ms): {format_percentiles(stats.echo_latencies)}")
+    if tick_durations is not None:
+        print(f"Server tick (ms):  {format_percentiles(tick_durations)}")
+    print(f"Connections: {stats.connect_failures} failed, {stats.dropped} dropped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless load test for the racing server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--bots", type=int, default=BOTS)
+    parser.add_argument("--rate", type=int, default=SEND_RATE, help="states per second per bot")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds of measurement")
+    parser.add_argument("--room-size", type=int, default=server.ROOM_CAPACITY, help="bots per room")
+    parser.add_argument("--measured", type=int, default=MEASURED_BOTS,
+                        help="bots that decode snapshots to measure echo latency")
+    parser.add_argument("--udp", action="store_true", help="send movement over UDP")
+    parser.add_argument("--tick-rate", type=int, default=server.TICK_RATE, help="tick rate of the spawned server")
+    parser.add_argument("--no-spawn", action="store_true",
+                        help="test an already running server instead of starting one")
+    parser.add_argument("--verbose", action="store_true", help="show the spawned server's log")
+    parser.add_argument("--max-p99", type=float,
+                        help="exit with status 1 if the p99 echo latency (ms) is above this")
+    args = parser.parse_args()
+
+    rooms = max(1, math.ceil(args.bots / args.room_size))
+    print(f"Load test: {args.bots} bots in {rooms} rooms, {args.rate} Hz, {args.duration:.0f} s, "
+          f"{'UDP' if args.udp else 'TCP'} movement, {args.host}:{args.port}")
+
+    control = child = None
+    if not args.no_spawn:
+        control, conn = multiprocessing.Pipe()
+        child = multiprocessing.Process(target=serve, daemon=True,
+                                        args=(conn, args.host, args.port, args.tick_rate, args.udp, args.verbose))
+        child.start()
+        time.sleep(1.0)  # Let the server bind its port
+
+    on_start = (lambda: control.send("start")) if control is not None else None
+    try:
+        stats, elapsed = asyncio.run(run_load(args.host, args.port, args.bots, args.rate, args.duration,
+                                              args.udp, rooms, args.measured, on_start))
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+    tick_durations = None
+    if control is not None:
+        control.send("stop")
+        tick_durations = control.recv()
+        child.join(2)
+        if child.is_alive():
+            child.terminate()
+
+    report(stats, elapsed, args.rate, tick_durations)
+    failed = stats.connect_failures or stats.dropped
+    if args.max_p99 is not None and stats.echo_latencies:
+        failed = failed or np.percentile(stats.echo_latencies, 99) * 1000 > args.max_p99
+    sys.exit(1 if failed else 0)
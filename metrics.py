@@ -0,0 +1,162 @@
+import asyncio
+import bisect
+import math
+
+# ----------------------------------------------------------------
+#                   MÉTRICAS
+# ----------------------------------------------------------------
+# In-process counters, gauges and histograms rendered in the Prometheus
+# text format, plus a minimal HTTP endpoint to scrape them. Everything runs
+# on the server's event loop, so no locking is needed.
+
+# Seconds; fits tick and broadcast times from well under 1 ms to a stall
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic total, optionally split by labels"""
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Without labels the single series exists (as 0) from the start
+        self.values = {} if self.labels else {(): 0}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self):
+        return sum(self.values.values())
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+
+class Gauge(Counter):
+    """Current value; either set directly or read from a function at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name, help, function=None, labels=()):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        self.values[_label_key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def total(self):
+        return self.function() if self.function is not None else super().total()
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, (), self.function()
+        else:
+            yield from super().samples()
+
+
+class Histogram:
+    """Distribution of observed values in fixed buckets"""
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            yield self.name + "_bucket", (("le", _format_value(bound)),), cumulative
+        yield self.name + "_sum", (), self.sum
+        yield self.name + "_count", (), self.count
+
+
+class Registry:
+    """Named metrics of one process"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, function=None, labels=()):
+        return self._add(Gauge(name, help, function, labels))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# ----------------------------------------------------------------
+#                   ENDPOINT HTTP
+# ----------------------------------------------------------------
+
+async def _handle_http(reader, writer, pages):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass  # Headers are not needed
+        parts = request.decode("latin-1").split()
+        page = pages.get(parts[1].split("?")[0]) if len(parts) >= 2 and parts[0] == "GET" else None
+        if page is None:
+            status, body = "404 Not Found", "not found\n"
+        else:
+            status, body = "200 OK", page()
+        data = body.encode("utf-8")
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, UnicodeDecodeError):
+        pass
+    finally:
+        writer.close()
+
+async def start_http_server(pages, host, port):
+    """Serve {path: function returning text} over plain HTTP/1.0 GET"""
+    return await asyncio.start_server(lambda r, w: _handle_http(r, w, pages), host, port, reuse_address=True)
@@ -0,0 +1,56 @@
+import time
+from collections import deque
+
+import numpy as np
+
+# ----------------------------------------------------------------
+#                   TIEMPOS POR ETAPA
+# ----------------------------------------------------------------
+# The render loop calls start_frame() and then mark(stage) after each stage;
+# every mark records the time since the previous one. Samples are kept in
+# bounded buffers, so the profiler can stay on in normal play.
+
+HISTORY = 3600  # Frames kept per stage (one minute at 60 FPS)
+PERCENTILES = (50, 90, 99)
+
+
+class FrameProfiler:
+    """Wall time spent in each stage of a frame"""
+
+    def __init__(self, history=None):
+        self.history = HISTORY if history is None else history
+        self.stages = {}  # Stage name -> deque of seconds, in first-seen order
+        self.frames = deque(maxlen=self.history)
+        self.frame_start = self.last = time.perf_counter()
+
+    def start_frame(self):
+        self.frame_start = self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        samples = self.stages.get(stage)
+        if samples is None:
+            samples = self.stages[stage] = deque(maxlen=self.history)
+        samples.append(now - self.last)
+        self.last = now
+
+    def end_frame(self):
+        self.frames.append(self.last - self.frame_start)
+
+    def reset(self):
+        self.stages.clear()
+        self.frames.clear()
+
+    def summary(self):
+        """{stage: {"mean", "p50", "p90", "p99", "max"}} in milliseconds, plus "frame" for the whole frame"""
+        result = {}
+        for stage, samples in list(self.stages.items()) + [("frame", self.frames)]:
+            if not samples:
+                continue
+            values = np.fromiter(samples, dtype=np.float64) * 1000.0
+            stats = {"mean": float(values.mean())}
+            for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                stats[f"p{p}"] = float(value)
+            stats["max"] = float(values.max())
+            result[stage] = stats
+        return result
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import struct
+from collections import namedtuple
+
+# ----------------------------------------------------------------
+#                   WIRE PROTOCOL
+# ----------------------------------------------------------------
+# Every message on the TCP stream is a frame: a 3-byte header (payload
+# length, message kind) followed by the payload. The first frame a client
+# sends is MSG_HELLO with the format it wants and the name of the race room
+# to join; the server answers with its own MSG_HELLO carrying the accepted
+# format, the assigned player id and the room it joined.
+#
+# If both sides set HELLO_UDP, the server's HELLO also carries a token and
+# the movement stream (states, acks and deltas) moves to UDP datagrams on
+# the port it announces: a DATAGRAM header followed by one or more frames. Older
+# or duplicated datagrams are dropped by sequence number; TCP stays in use
+# for join/leave, lap and race-result events.
+
+FORMAT_JSON = 0
+FORMAT_BINARY = 1
+
+MSG_HELLO = 0
+MSG_JSON = 1       # UTF-8 JSON object (events, or state in JSON format)
+MSG_STATE = 2      # Client -> server: one binary player state
+MSG_SNAPSHOT = 3   # Server -> client: binary table of all players
+MSG_DELTA = 4      # Server -> client: changes against an acknowledged snapshot
+MSG_ACK = 5        # Client -> server: newest snapshot tick applied
+MSG_POSITIONS = 6  # Server -> client: player ids in race order
+
+HEADER = struct.Struct("!HB")          # payload length, message kind
+HELLO = struct.Struct("!BBHIH")        # format, flags, player id, UDP token, UDP port; then room name
+STATE = struct.Struct("!HHHBBB")       # x, y, angle, lap, checkpoint, flags
+SNAPSHOT_COUNT = struct.Struct("!H")
+SNAPSHOT_ENTRY = struct.Struct("!HHHHBBB")  # player id + STATE
+ACK = struct.Struct("!I")              # snapshot tick
+POSITIONS_COUNT = struct.Struct("!H")  # then that many player ids (!H)
+DATAGRAM = struct.Struct("!HII")       # player id, UDP token, sequence
+
+MAX_PAYLOAD = 0xFFFF
+
+FLAG_FINISHED = 0x01
+
+HELLO_UDP = 0x01  # Client: wants UDP; server: UDP accepted (token is valid)
+
+DEFAULT_ROOM = "main"
+MAX_ROOM_NAME = 64  # Bytes of UTF-8
+
+Hello = namedtuple("Hello", "format flags player_id token udp_port room")
+
+# Exceptions a malformed payload can raise while decoding
+DECODE_ERRORS = (ValueError, struct.error)
+
+# Positions are sent as unsigned 1/16 px fixed point (up to 4095 px) and
+# angles as a 16-bit fraction of a full turn.
+POSITION_SCALE = 16
+ANGLE_SCALE = 65536 / 360.0
+
+
+def quantize_position(value):
+    return max(0, min(0xFFFF, int(round(value * POSITION_SCALE))))
+
+def dequantize_position(value):
+    return value / POSITION_SCALE
+
+def quantize_angle(angle):
+    return int(round((angle % 360.0) * ANGLE_SCALE)) & 0xFFFF
+
+def dequantize_angle(value):
+    return value / ANGLE_SCALE
+
+
+def frame(kind, payload):
+    """Prefix a payload with its frame header"""
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload too large: {len(payload)} bytes")
+    return HEADER.pack(len(payload), kind) + payload
+
+def encode_hello(fmt, player_id=0, flags=0, token=0, udp_port=0, room=""):
+    name = room.encode("utf-8")
+    if len(name) > MAX_ROOM_NAME:
+        raise ValueError(f"Room name too long: {len(name)} bytes")
+    return frame(MSG_HELLO, HELLO.pack(fmt, flags, player_id, token, udp_port) + name)
+
+def decode_hello(payload):
+    """Return a Hello; udp_port 0 means the server's own port, room "" the default room"""
+    fields = HELLO.unpack_from(payload)
+    name = payload[HELLO.size:]
+    if len(name) > MAX_ROOM_NAME:
+        raise ValueError(f"Room name too long: {len(name)} bytes")
+    return Hello(*fields, name.decode("utf-8"))
+
+def encode_datagram(player_id, token, sequence, frames):
+    """Wrap already framed bytes into one UDP datagram"""
+    return DATAGRAM.pack(player_id, token, sequence) + frames
+
+def decode_datagram(data):
+    """Return (player id, token, sequence, frames) for a received datagram"""
+    player_id, token, sequence = DATAGRAM.unpack_from(data)
+    frames, _ = split_frames(data, DATAGRAM.size)
+    return player_id, token, sequence, frames
+
+def encode_json(obj):
+    return frame(MSG_JSON, json.dumps(obj, separators=(",", ":")).encode())
+
+def decode_json(payload):
+    return json.loads(payload.decode())
+
+
+def state_fields(player_data):
+    """Quantize a player state dict into the STATE field tuple"""
+    position = player_data.get("position", (0, 0))
+    flags = FLAG_FINISHED if player_data.get("finished") else 0
+    return (
+        quantize_position(position[0]),
+        quantize_position(position[1]),
+        quantize_angle(player_data.get("angle", 0)),
+        max(0, min(int(player_data.get("lap", 0)), 0xFF)),
+        max(0, min(int(player_data.get("checkpoints", 0)), 0xFF)),
+        flags,
+    )
+
+def state_from_fields(x, y, angle, lap, checkpoint, flags):
+    return {
+        "position": [dequantize_position(x), dequantize_position(y)],
+        "angle": dequantize_angle(angle),
+        "lap": lap,
+        "checkpoints": checkpoint,
+        "finished": bool(flags & FLAG_FINISHED),
+    }
+
+def encode_state(player_data, fmt=FORMAT_BINARY):
+    """Encode one player's state dict as a frame in the given format"""
+    if fmt == FORMAT_JSON:
+        return encode_json(player_data)
+    return frame(MSG_STATE, STATE.pack(*state_fields(player_data)))
+
+def decode_state(payload):
+    return state_from_fields(*STATE.unpack(payload))
+
+def encode_ack(tick):
+    return frame(MSG_ACK, ACK.pack(tick))
+
+def decode_ack(payload):
+    return ACK.unpack(payload)[0]
+
+def encode_players(players, fmt=FORMAT_BINARY):
+    """Encode the whole player table ({id: state}) as a frame"""
+    if fmt == FORMAT_JSON:
+        return encode_json({"status": "ok", "players": players})
+    parts = [SNAPSHOT_COUNT.pack(len(players))]
+    for player_id, player_data in players.items():
+        parts.append(SNAPSHOT_ENTRY.pack(int(player_id), *state_fields(player_data)))
+    return frame(MSG_SNAPSHOT, b"".join(parts))
+
+def decode_players(payload):
+    (count,) = SNAPSHOT_COUNT.unpack_from(payload)
+    players = {}
+    offset = SNAPSHOT_COUNT.size
+    for _ in range(count):
+        player_id, *fields = SNAPSHOT_ENTRY.unpack_from(payload, offset)
+        players[player_id] = state_from_fields(*fields)
+        offset += SNAPSHOT_ENTRY.size
+    return players
+
+def encode_positions(player_ids, fmt=FORMAT_BINARY):
+    """Encode the race order (player ids, leader first) as a frame"""
+    if fmt == FORMAT_JSON:
+        return encode_json({"positions": list(player_ids)})
+    return frame(MSG_POSITIONS, POSITIONS_COUNT.pack(len(player_ids))
+                 + struct.pack(f"!{len(player_ids)}H", *player_ids))
+
+def decode_positions(payload):
+    (count,) = POSITIONS_COUNT.unpack_from(payload)
+    return list(struct.unpack_from(f"!{count}H", payload, POSITIONS_COUNT.size))
+
+
+def split_frames(data, offset=0):
+    """Split complete frames out of data; returns (frames, offset of the first unused byte)"""
+    frames = []
+    end = len(data)
+    while end - offset >= HEADER.size:
+        length, kind = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        if end - start < length:
+            break
+        frames.append((kind, bytes(data[start:start + length])))
+        offset = start + length
+    return frames, offset
+
+
+class FrameDecoder:
+    """Incremental frame splitter for a byte stream.
+
+    Bytes are appended to a single bytearray and consumed from the front
+    once per feed(), so coalesced or split frames are handled without
+    re-scanning or re-concatenating the buffer.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Add received bytes and return the list of complete (kind, payload) frames"""
+        self.buffer += data
+        frames, offset = split_frames(self.buffer)
+        if offset:
+            del self.buffer[:offset]
+        return frames
+
+
+async def read_frame(reader, timeout=None):
+    """Read one (kind, payload) frame from an asyncio StreamReader
+
+    The timeout only applies while waiting for the next header, so a
+    timeout never leaves a half-read frame behind.
+    """
+    header = await asyncio.wait_for(reader.readexactly(HEADER.size), timeout)
+    length, kind = HEADER.unpack(header)
+    payload = await reader.readexactly(length) if length else b""
+    return kind, payload
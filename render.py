@@ -0,0 +1,145 @@
+from collections import OrderedDict
+
+import pygame
+
+# ----------------------------------------------------------------
+#                   CAPAS DE RENDER
+# ----------------------------------------------------------------
+
+class StaticLayer:
+    """Pre-baked Surface for everything that does not change between frames.
+
+    The draw callback paints the layer once into a display-format Surface;
+    it is only called again after invalidate() (e.g. a track change) or
+    when the target size changes.
+    """
+
+    def __init__(self, draw):
+        self.draw = draw
+        self.surface = None
+
+    def invalidate(self):
+        self.surface = None
+
+    def get(self, size):
+        if self.surface is None or self.surface.get_size() != size:
+            surface = pygame.Surface(size)
+            self.draw(surface)
+            self.surface = surface.convert()
+        return self.surface
+
+    def blit(self, screen):
+        screen.blit(self.get(screen.get_size()), (0, 0))
+
+
+class SpriteAtlas:
+    """Sprites pre-rotated at a fixed angular resolution.
+
+    Every image is rotated once per step degrees at construction, so
+    drawing a car at any angle is a list lookup instead of a
+    pygame.transform.rotate call.
+    """
+
+    def __init__(self, images, step=1.0, alpha=None):
+        self.step = step
+        self.count = int(round(360.0 / step))
+        self.frames = {}
+        for name, image in images.items():
+            image = image.convert_alpha()
+            frames = [pygame.transform.rotate(image, i * step) for i in range(self.count)]
+            if alpha is not None:
+                for frame in frames:
+                    frame.set_alpha(alpha)  # Translucent sprites (the ghost car)
+            self.frames[name] = frames
+
+    def rotated(self, name, angle):
+        return self.frames[name][int(round(angle / self.step)) % self.count]
+
+    def get(self, name, angle, center):
+        """Return the sprite rotated to the nearest step and its rect centred on center"""
+        surface = self.rotated(name, angle)
+        return surface, surface.get_rect(center=center)
+
+
+class DirtyRects:
+    """Screen regions drawn over the static layer this frame and the last one.
+
+    When enabled, a frame only paints the background back over what the
+    previous frame drew and hands those rects plus the new ones to
+    pygame.display.update(), instead of repainting and flipping the whole
+    window. Disabled, it repaints everything and flips, as before.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.previous = []
+        self.current = []
+        self.full = True  # Repaint everything next frame (first frame, resize)
+        self.area = 0     # Pixels pushed to the display by the last update()
+
+    def invalidate(self):
+        self.full = True
+
+    def add(self, rect):
+        """Record a rect drawn this frame (what blit() and pygame.draw return)"""
+        if self.enabled:
+            self.current.append(rect)
+        return rect
+
+    def restore(self, screen, background):
+        """Paint the background back over last frame's drawing"""
+        if self.full or not self.enabled:
+            screen.blit(background, (0, 0))
+        else:
+            for rect in self.previous:
+                screen.blit(background, rect, rect)
+
+    def update(self, screen):
+        """Push this frame to the display"""
+        if self.full or not self.enabled:
+            pygame.display.flip()
+            self.area = screen.get_width() * screen.get_height()
+            self.full = False
+        else:
+            rects = self.previous + self.current
+            pygame.display.update(rects)
+            self.area = sum(rect.width * rect.height for rect in rects)
+        self.previous, self.current = self.current, []
+
+
+class FontRegistry:
+    """Resolves each (name, size, bold, italic) system font once"""
+
+    def __init__(self):
+        self.fonts = {}
+
+    def get(self, name, size, bold=False, italic=False):
+        key = (name, size, bold, italic)
+        font = self.fonts.get(key)
+        if font is None:
+            font = self.fonts[key] = pygame.font.SysFont(name, size, bold=bold, italic=italic)
+        return font
+
+
+class TextCache:
+    """Bounded LRU cache of rendered text Surfaces keyed by (font, text, color).
+
+    Static labels are rasterized once and values such as lap counters are
+    only rendered again when the displayed string changes.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.surfaces = OrderedDict()
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, color, antialias)  # color must be hashable (tuple or name)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+        surface = font.render(text, antialias, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.maxsize:
+            self.surfaces.popitem(last=False)
+        return surface
@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import datetime
+import os
+import queue
+import re
+import struct
+import threading
+import time
+
+import numpy as np
+
+import protocol
+import snapshots
+
+# ----------------------------------------------------------------
+#                   GRABACIÓN DE CARRERAS
+# ----------------------------------------------------------------
+# A replay is a header followed by fixed-size little-endian records, one per
+# player and tick: the tick, the seconds since the recording started and
+# the quantized STATE fields of the snapshot. Only players whose state
+# changed are written, except on keyframe ticks (every KEYFRAME_INTERVAL),
+# which hold the whole table; a player leaving is a record with
+# FLAG_REMOVED. Keyframes are listed in a sidecar index (<file>.idx), so a
+# reader can jump to any time with two binary searches and replay at most
+# one keyframe interval of records.
+#
+# The live tick only packs records into a buffer; every FLUSH_INTERVAL
+# ticks the buffer is handed to a writer thread, so the event loop never
+# waits on the disk.
+
+MAGIC = b"RPLY"
+VERSION = 1
+HEADER = struct.Struct("<4sHHd")          # magic, version, tick rate, start (Unix time)
+RECORD = struct.Struct("<IfHHHHBBB")      # tick, time, player id, x, y, angle, lap, checkpoint, flags
+INDEX = struct.Struct("<IfQ")             # keyframe tick, time, number of its first record
+
+RECORD_DTYPE = np.dtype([("tick", "<u4"), ("time", "<f4"), ("player", "<u2"), ("x", "<u2"), ("y", "<u2"),
+                         ("angle", "<u2"), ("lap", "u1"), ("checkpoint", "u1"), ("flags", "u1")])
+INDEX_DTYPE = np.dtype([("tick", "<u4"), ("time", "<f4"), ("record", "<u8")])
+
+FLAG_REMOVED = 0x80  # Record flag: the player left; never a protocol flag
+
+KEYFRAME_INTERVAL = 30  # Ticks between keyframes (1 s at 30 Hz)
+FLUSH_INTERVAL = 30     # Ticks between hand-offs to the writer thread
+EXTENSION = ".replay"
+CHUNK = 4096            # Records converted at a time while streaming
+
+
+def replay_path(directory, room):
+    """A new file name for a recording of room in directory"""
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", room) or "room"
+    base = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}")
+    path = base + EXTENSION
+    count = 1
+    while os.path.exists(path):
+        count += 1
+        path = f"{base}-{count}{EXTENSION}"
+    return path
+
+
+class ReplayWriter:
+    """Appends a room's snapshots to a replay log from a background thread"""
+
+    def __init__(self, path, tick_rate, keyframe_interval=KEYFRAME_INTERVAL, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.flush_interval = flush_interval
+        self.file = open(path, "wb")
+        self.index_file = open(path + ".idx", "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, tick_rate, time.time()))
+        self.started = time.perf_counter()
+        self.previous = {}
+        self.ticks = 0
+        self.records = 0  # Records written so far, for the index
+        self.pending = bytearray()
+        self.pending_index = bytearray()
+        self.queue = queue.SimpleQueue()
+        # Not a daemon: the last batches are still written if the server exits
+        self.thread = threading.Thread(target=self._write_loop, name=f"replay {os.path.basename(path)}")
+        self.thread.start()
+
+    def record(self, tick, snapshot):
+        """Add one tick's snapshot ({player_id: STATE fields})"""
+        now = time.perf_counter() - self.started
+        keyframe = self.ticks % self.keyframe_interval == 0
+        self.ticks += 1
+        if keyframe:
+            self.pending_index += INDEX.pack(tick, now, self.records)
+        pack = RECORD.pack
+        previous = self.previous
+        for player_id in previous.keys() - snapshot.keys():
+            self.pending += pack(tick, now, player_id, 0, 0, 0, 0, 0, FLAG_REMOVED)
+            self.records += 1
+        for player_id, fields in snapshot.items():
+            if keyframe or previous.get(player_id) != fields:
+                self.pending += pack(tick, now, player_id, *fields)
+                self.records += 1
+        self.previous = snapshot
+        if self.ticks % self.flush_interval == 0:
+            self.flush()
+
+    def flush(self):
+        if self.pending or self.pending_index:
+            self.queue.put((bytes(self.pending), bytes(self.pending_index)))
+            self.pending.clear()
+            self.pending_index.clear()
+
+    def close(self):
+        """Hand over what is left; the thread writes it and closes the files"""
+        self.flush()
+        self.queue.put(None)
+
+    def _write_loop(self):
+        try:
+            while True:
+                batch = self.queue.get()
+                if batch is None:
+                    break
+                data, index = batch
+                # Records first, so an index entry never points past the data
+                self.file.write(data)
+                self.file.flush()
+                if index:
+                    self.index_file.write(index)
+                    self.index_file.flush()
+        finally:
+            self.file.close()
+            self.index_file.close()
+
+
+def _apply_row(snapshot, row):
+    _, _, player_id, x, y, angle, lap, checkpoint, flags = row
+    if flags & FLAG_REMOVED:
+        snapshot.pop(player_id, None)
+    else:
+        snapshot[player_id] = (x, y, angle, lap, checkpoint, flags)
+
+
+class ReplayReader:
+    """Memory-mapped replay with O(log n) seeking by time"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path}: not a replay (file too short)")
+        magic, version, self.tick_rate, self.started = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a version {VERSION} replay")
+
+        # A file still being written may end in a partial record
+        count = (os.path.getsize(path) - HEADER.size) // RECORD_DTYPE.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER.size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+        self.times = self.records["time"]
+
+        index_path = path + ".idx"
+        entries = os.path.getsize(index_path) // INDEX_DTYPE.itemsize if os.path.exists(index_path) else 0
+        if entries:
+            index = np.memmap(index_path, dtype=INDEX_DTYPE, mode="r", shape=(entries,))
+            index = index[index["record"] < count]
+        else:
+            index = np.zeros(0, dtype=INDEX_DTYPE)
+        if not len(index) and count:
+            # No usable index: the first tick is always a keyframe
+            index = np.array([(self.records[0]["tick"], self.records[0]["time"], 0)], dtype=INDEX_DTYPE)
+        self.index = index
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def duration(self):
+        return float(self.times[-1]) if len(self.records) else 0.0
+
+    def _rows(self, start, end):
+        """Records start..end as tuples, converted a chunk at a time"""
+        for offset in range(start, end, CHUNK):
+            yield from self.records[offset:min(end, offset + CHUNK)].tolist()
+
+    def seek(self, at):
+        """Return (tick, time, snapshot, next record) for the last tick at or before at seconds"""
+        keyframe = int(np.searchsorted(self.index["time"], at, side="right")) - 1
+        if keyframe < 0:
+            return None, 0.0, {}, 0
+        start = int(self.index["record"][keyframe])
+        end = int(np.searchsorted(self.times, at, side="right"))
+        snapshot = {}
+        tick, when = None, 0.0
+        for row in self._rows(start, end):
+            tick, when = row[0], row[1]
+            _apply_row(snapshot, row)
+        return tick, when, snapshot, end
+
+    def state_at(self, at):
+        """{player_id: STATE fields} at at seconds into the recording"""
+        return self.seek(at)[2]
+
+    def frames(self, start=0.0):
+        """Yield (tick, time, snapshot) for every recorded tick from start on"""
+        tick, when, snapshot, position = self.seek(start)
+        if tick is not None:
+            yield tick, when, dict(snapshot)
+        tick = None
+        for row in self._rows(position, len(self.records)):
+            if row[0] != tick and tick is not None:
+                yield tick, when, dict(snapshot)
+            tick, when = row[0], row[1]
+            _apply_row(snapshot, row)
+        if tick is not None:
+            yield tick, when, dict(snapshot)
+
+
+# ----------------------------------------------------------------
+#                   REPRODUCCIÓN PARA ESPECTADORES
+# ----------------------------------------------------------------
+# serve() speaks the server side of the protocol, so the normal client can
+# connect as a spectator (player id 0) and watch a recording: frames are
+# sent at the recorded pace as deltas against the spectator's acks.
+
+async def stream(reader, writer, replay, start=0.0, speed=1.0):
+    """Send the replay from start seconds on to one connected client"""
+    kind, payload = await protocol.read_frame(reader, 10)
+    if kind != protocol.MSG_HELLO:
+        raise ValueError(f"expected HELLO, got message kind {kind}")
+    fmt = protocol.decode_hello(payload).format
+    if fmt not in (protocol.FORMAT_JSON, protocol.FORMAT_BINARY):
+        fmt = protocol.FORMAT_JSON
+    writer.write(protocol.encode_hello(fmt, 0, room=os.path.basename(replay.path)))
+
+    acked = [snapshots.NO_BASELINE]
+
+    async def read_acks():
+        while True:
+            kind, payload = await protocol.read_frame(reader)
+            if kind == protocol.MSG_ACK:
+                acked[0] = max(acked[0], protocol.decode_ack(payload))
+
+    acks = asyncio.create_task(read_acks())
+    history = snapshots.SnapshotHistory()
+    loop = asyncio.get_running_loop()
+    began = loop.time()
+    try:
+        for tick, when, snapshot in replay.frames(start):
+            delay = (when - start) / speed - (loop.time() - began)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if acks.done():
+                break  # The spectator went away
+            history.add(tick, snapshot)
+            if fmt == protocol.FORMAT_JSON:
+                writer.write(protocol.encode_players(snapshots.snapshot_to_players(snapshot), fmt))
+            else:
+                baseline_tick = acked[0]
+                baseline = history.get(baseline_tick)
+                if baseline is None:
+                    baseline_tick = snapshots.NO_BASELINE
+                writer.write(snapshots.encode_delta(tick, snapshot, baseline_tick, baseline))
+            await writer.drain()
+    finally:
+        acks.cancel()
+        writer.close()
+
+async def serve(replay, host, port, start=0.0, speed=1.0):
+    async def handle(reader, writer):
+        addr = writer.get_extra_info('peername')
+        print(f"Spectator {addr} watching from {start:.1f} s")
+        try:
+            await stream(reader, writer, replay, start, speed)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError) as e:
+            print(f"Spectator {addr} left: {e!r}")
+        except protocol.DECODE_ERRORS as e:
+            print(f"Bad data from spectator {addr}: {e}")
+
+    server = await asyncio.start_server(handle, host, port, reuse_address=True)
+    print(f"Serving {replay.path} ({replay.duration:.1f} s) on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or serve a race replay")
+    parser.add_argument("path")
+    parser.add_argument("--at", type=float, help="print the player table at this many seconds")
+    parser.add_argument("--serve", action="store_true", help="stream the replay to spectator clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5556)
+    parser.add_argument("--start", type=float, default=0.0, help="seconds into the replay to start from")
+    parser.add_argument("--speed", type=float, default=1.0)
+    args = parser.parse_args()
+
+    replay = ReplayReader(args.path)
+    started = datetime.datetime.fromtimestamp(replay.started)
+    players = len(np.unique(replay.records["player"])) if len(replay) else 0
+    print(f"{args.path}: recorded {started:%Y-%m-%d %H:%M:%S} at {replay.tick_rate} Hz, "
+          f"{replay.duration:.1f} s, {len(replay)} records, {len(replay.index)} keyframes, {players} players")
+    if args.at is not None:
+        for player_id, data in sorted(snapshots.snapshot_to_players(replay.state_at(args.at)).items()):
+            print(f"  P{player_id}: {data}")
+    if args.serve:
+        try:
+            asyncio.run(serve(replay, args.host, args.port, args.start, args.speed))
+        except KeyboardInterrupt:
+            pass
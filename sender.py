@@ -0,0 +1,99 @@
+import threading
+import time
+import traceback
+from collections import deque
+
+# ----------------------------------------------------------------
+#                   ENVÍO EN SEGUNDO PLANO
+# ----------------------------------------------------------------
+# The render loop hands its newest car state to a StateSender and carries
+# on; a background thread does the encoding and the socket calls. Position
+# updates go through a single slot: a state that was not sent yet is
+# replaced by the next one, and the slot is sent at most `rate` times per
+# second whatever the frame rate. Reliable events (lap completed, race
+# finished) are queued instead, wake the thread at once and go out before
+# the next position update.
+
+SEND_RATE = 30  # Position updates per second
+
+
+class StateSender:
+    """Sends the latest car state at a fixed rate, and reliable events as they come, from its own thread"""
+
+    def __init__(self, send, rate=SEND_RATE):
+        self.send = send  # send(state, reliable), called on the sender thread
+        self.interval = 1.0 / rate
+        self.condition = threading.Condition()
+        self.latest = None
+        self.events = deque()
+        self.running = True
+        self.sent = 0
+        self.coalesced = 0  # Updates replaced by a newer one before they were sent
+        self.failures = 0
+        self.thread = threading.Thread(target=self._run, name="state sender", daemon=True)
+        self.thread.start()
+
+    def update(self, state):
+        """Offer the newest state; never waits for the network"""
+        with self.condition:
+            if self.latest is None:
+                self.condition.notify()
+            else:
+                self.coalesced += 1
+            self.latest = state
+
+    def send_event(self, state):
+        """Queue a state that must be delivered, ahead of the rate limit"""
+        with self.condition:
+            self.events.append(state)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def _next(self, next_send):
+        """Wait for work; return (events, state), or None once closed"""
+        with self.condition:
+            while True:
+                if not self.running:
+                    return None
+                now = time.monotonic()
+                due = self.latest is not None and now >= next_send
+                if self.events or due:
+                    events = list(self.events)
+                    self.events.clear()
+                    state = None
+                    if due:
+                        state, self.latest = self.latest, None
+                    return events, state
+                self.condition.wait(next_send - now if self.latest is not None else None)
+
+    def _run(self):
+        next_send = time.monotonic()
+        failing = None  # Type of the error in the current run of failures
+        while True:
+            work = self._next(next_send)
+            if work is None:
+                return
+            events, state = work
+            if state is not None:
+                # Also when the send fails, so an outage is retried at the send rate
+                next_send = max(next_send + self.interval, time.monotonic() - self.interval)
+            try:
+                for event in events:
+                    self.send(event, True)
+                if state is not None:
+                    self.send(state, False)
+                    self.sent += 1
+                failing = None
+            except Exception as e:
+                # Anything but OSError is a bug in send(): report it, but keep sending
+                self.failures += 1
+                if type(e) is not failing:
+                    if isinstance(e, OSError):
+                        print(f"Could not send to the server: {e}")
+                    else:
+                        traceback.print_exc()
+                failing = type(e)
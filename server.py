@@ -1,113 +1,743 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import secrets
 import socket
-import threading
-import json
 import time
+import zlib
+from collections import deque
+
+import interest
+import metrics
+import protocol
+import replay
+import snapshots
+import standings
 
 SERVER_IP = '192.168.33.68'
 SERVER_PORT = 5555
+CLIENT_TIMEOUT = 10  # Seconds without data before a client is dropped
+TICK_RATE = 30  # World snapshots broadcast per second
+STATS_INTERVAL = 30  # Seconds between tick statistics log lines
+METRICS_HOST = '127.0.0.1'  # The metrics endpoint is only meant for the local host
+ROOM_CAPACITY = 32  # Players per race room
+WRITE_BUFFER_LIMIT = 16 * 1024  # Bytes a TCP client may have unsent before frames wait in its outbox
+OUTBOX_LIMIT = 64  # Frames an outbox may hold
+STALL_TIMEOUT = 5  # Seconds a client may stay backed up before it is dropped
+POSITIONS_INTERVAL = 30  # Ticks between race-order frames when the order does not change
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allow reuse of address
-server.bind((SERVER_IP, SERVER_PORT))
-server.listen()
-
-players = {}
 player_ids = {}
-next_id = 1
-clients = []  # Keep track of all client connections
+next_id = 1  # Player ids are unique per process, so UDP can route by id
+rooms = {}  # Room name -> Room
+tick_rate = TICK_RATE  # Tick rate of new rooms
+record_dir = None  # Directory for replays of every room, if recording
+udp_transport = None  # Movement datagram endpoint, if UDP is enabled
+udp_port = 0  # Port of that endpoint, announced in the HELLO
+udp_clients = {}  # Player id -> ClientInfo for connections that negotiated UDP
+
+# Every connection and room is served by coroutines on a single event loop
+# per process, so the shared dicts above are only touched from one thread
+# and need no locking.
+
+# ----------------------------------------------------------------
+#                   MÉTRICAS
+# ----------------------------------------------------------------
+registry = metrics.Registry()
+connections_gauge = registry.gauge("race_connections", "Connected players",
+                                   lambda: sum(len(room.clients) for room in rooms.values()))
+rooms_gauge = registry.gauge("race_rooms", "Open race rooms", lambda: len(rooms))
+accepted_counter = registry.counter("race_connections_accepted_total", "Connections accepted")
+handshake_failures = registry.counter("race_handshake_failures_total", "Connections dropped during the HELLO")
+messages_in = registry.counter("race_messages_received_total", "Frames received from clients", ("transport",))
+bytes_in = registry.counter("race_bytes_received_total", "Bytes received from clients", ("transport",))
+messages_out = registry.counter("race_messages_sent_total", "Snapshot frames sent to clients", ("transport",))
+bytes_out = registry.counter("race_bytes_sent_total", "Bytes sent to clients", ("transport",))
+decode_errors = registry.counter("race_decode_errors_total", "Malformed frames or datagrams received", ("transport",))
+send_failures = registry.counter("race_send_failures_total", "Clients dropped because a send failed")
+slow_disconnects = registry.counter("race_slow_client_disconnects_total", "Clients dropped for not keeping up")
+dropped_snapshots = registry.counter("race_snapshots_dropped_total", "Queued snapshots replaced by a newer one")
+tick_errors = registry.counter("race_tick_errors_total", "Room ticks that raised an exception")
+tick_seconds = registry.histogram("race_tick_seconds", "Duration of one room tick")
+broadcast_seconds = registry.histogram("race_broadcast_seconds", "Time to encode and send one room snapshot")
+
+class SlowClient(Exception):
+    """The client does not read fast enough to keep a connection"""
+
+class Outbox:
+    """Bounded send queue of one TCP client, drained without ever waiting on the socket.
+
+    Frames are written straight to the transport while its buffer is below
+    WRITE_BUFFER_LIMIT and queued otherwise. A new snapshot makes the queued
+    ones stale, so they are dropped (the client acks whatever it gets and
+    deltas follow). A client whose outbox overflows, or that stays backed
+    up for STALL_TIMEOUT, raises SlowClient.
+    """
+    __slots__ = ("transport", "queue", "stalled_since", "dropped")
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.queue = deque()  # (frame, droppable)
+        self.stalled_since = None
+        self.dropped = 0
+
+    def send(self, data, now, droppable=True):
+        """Queue a frame and write what the transport takes; returns (frames, bytes) written"""
+        if droppable and self.queue:
+            kept = [item for item in self.queue if not item[1]]
+            if len(kept) < len(self.queue):
+                dropped_snapshots.inc(len(self.queue) - len(kept))
+                self.dropped += len(self.queue) - len(kept)
+                self.queue = deque(kept)
+        self.queue.append((data, droppable))
+        if len(self.queue) > OUTBOX_LIMIT:
+            raise SlowClient(f"{len(self.queue)} frames queued")
+        return self.flush(now)
+
+    def flush(self, now):
+        frames = size = 0
+        transport = self.transport
+        while self.queue and transport.get_write_buffer_size() < WRITE_BUFFER_LIMIT:
+            data = self.queue.popleft()[0]
+            transport.write(data)
+            frames += 1
+            size += len(data)
+        if not self.queue:
+            self.stalled_since = None
+        elif self.stalled_since is None:
+            self.stalled_since = now
+        elif now - self.stalled_since > STALL_TIMEOUT:
+            raise SlowClient(f"backed up for {now - self.stalled_since:.1f} s")
+        return frames, size
+
+class ClientInfo:
+    """Per-connection protocol state"""
+    __slots__ = ("fmt", "player_id", "room", "acked_tick", "last_seen", "udp_token", "udp_addr", "udp_sequence",
+                 "messages_in", "bytes_in", "messages_out", "bytes_out", "outbox")
+
+    def __init__(self, fmt, player_id, room, transport=None):
+        self.fmt = fmt
+        self.player_id = player_id
+        self.room = room
+        self.outbox = Outbox(transport) if transport is not None else None
+        self.acked_tick = snapshots.NO_BASELINE
+        self.last_seen = time.monotonic()
+        self.udp_token = 0
+        self.udp_addr = None  # Known once the client's first datagram arrives
+        self.udp_sequence = 0
+        self.messages_in = 0
+        self.bytes_in = 0
+        self.messages_out = 0
+        self.bytes_out = 0
+
+    def received(self, size, transport):
+        self.messages_in += 1
+        self.bytes_in += size
+        messages_in.inc(transport=transport)
+        bytes_in.inc(size, transport=transport)
+
+class TickStats:
+    """Tick duration and overrun accounting for the tick loop"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+
+    def record(self, duration):
+        self.ticks += 1
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+
+    def summary(self):
+        avg_ms = self.total_duration / self.ticks * 1000 if self.ticks else 0.0
+        return (f"{self.ticks} ticks, avg {avg_ms:.2f} ms, max {self.max_duration * 1000:.2f} ms, "
+                f"{self.overruns} overruns, {self.skipped} skipped")
+
+# ----------------------------------------------------------------
+#                   SALAS DE CARRERA
+# ----------------------------------------------------------------
+# Each named room is an independent race with its own players, snapshot
+# history and tick loop. Rooms are opened by their first player and closed
+# when the last one leaves; with --record each room writes a replay file.
+# Binary clients in big rooms get a filtered view of each snapshot (see
+# interest.py); JSON clients always get the whole table. The race order
+# (standings.py) rides along with the snapshot whenever it changes, and
+# every finish is announced with the winner and positions over TCP.
+
+class Room:
+    """One race: its players, connections, snapshot history and tick loop"""
+
+    def __init__(self, name, tick_rate=TICK_RATE):
+        self.name = name
+        self.tick_rate = tick_rate
+        self.players = {}
+        self.latest_inputs = {}  # Newest state received from each player since the last tick
+        self.clients = {}  # StreamWriter -> ClientInfo
+        self.current_tick = 0
+        self.history = snapshots.SnapshotHistory()
+        self.interest = interest.InterestManager()
+        self.standings = standings.Standings()
+        self.positions_version = None  # Standings version last sent
+        self.events = []  # Reliable frames for every client, sent with the next broadcast
+        self.tick_stats = TickStats()
+        self.ticker = None
+        self.recorder = None
+
+    def is_full(self):
+        return len(self.clients) >= ROOM_CAPACITY
+
+    def start(self):
+        if record_dir is not None:
+            self.recorder = replay.ReplayWriter(replay.replay_path(record_dir, self.name), self.tick_rate)
+            print(f"Recording room '{self.name}' to {self.recorder.path}")
+        self.ticker = asyncio.create_task(self.tick_loop())
+
+    def stop(self):
+        if self.ticker is not None:
+            self.ticker.cancel()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def remove(self, conn, player_id):
+        self.clients.pop(conn, None)
+        self.players.pop(player_id, None)
+        self.latest_inputs.pop(player_id, None)
+        self.interest.forget(player_id)
+        self.standings.remove(player_id)
+
+    def encode_for(self, info, tick, snapshot, players_state, entries=None):
+        """Return the cache key and encoder for one client's view of this tick
+
+        entries is shared by the clients of one tick (see snapshots.encode_delta).
+        """
+        if info.fmt == protocol.FORMAT_JSON:
+            return "json", lambda: protocol.encode_players(players_state, protocol.FORMAT_JSON)
+        view = self.interest.view(tick, info.player_id, snapshot)
+        baseline_tick = info.acked_tick
+        baseline = self.interest.history(info.player_id).get(baseline_tick)
+        if baseline is None:
+            baseline_tick = snapshots.NO_BASELINE
+        key = baseline_tick
+        if view is not snapshot or (baseline and baseline is not self.history.get(baseline_tick)):
+            key = info  # A filtered view (or baseline) only this client has
+        return key, lambda: snapshots.encode_delta(tick, view, baseline_tick, baseline, entries)
+
+    def broadcast(self, tick, snapshot, players_state):
+        """Send this tick to all clients in the room, encoded once per format and baseline.
+
+        Nothing here waits on a socket: TCP frames go through each client's
+        Outbox, so a slow client only ever delays itself.
+        """
+        encoded = {}
+        entries = {}
+        disconnected = []
+        sent = {"tcp": [0, 0], "udp": [0, 0]}  # Transport -> [messages, bytes]
+        now = time.monotonic()
+        extras = {}  # Format -> race order frame, sent after the snapshot
+        if self.standings.version != self.positions_version or tick % POSITIONS_INTERVAL == 0:
+            self.positions_version = self.standings.version
+            order = self.standings.positions()
+            extras = {fmt: protocol.encode_positions(order, fmt) for fmt in (protocol.FORMAT_JSON, protocol.FORMAT_BINARY)}
+        events, self.events = self.events, []
+        for client, info in self.clients.items():
+            try:
+                if client.is_closing():
+                    raise ConnectionError("transport closing")
+                for event in events:
+                    info.outbox.send(event, now, droppable=False)
+                key, encode = self.encode_for(info, tick, snapshot, players_state, entries)
+                if key not in encoded:
+                    encoded[key] = encode() + extras.get(info.fmt, b"")
+                if info.udp_addr is not None:
+                    data = protocol.encode_datagram(info.player_id, info.udp_token, tick, encoded[key])
+                    udp_transport.sendto(data, info.udp_addr)
+                    count, size = 1, len(data)
+                    totals = sent["udp"]
+                else:
+                    count, size = info.outbox.send(encoded[key], now)
+                    totals = sent["tcp"]
+                info.messages_out += count
+                info.bytes_out += size
+                totals[0] += count
+                totals[1] += size
+            except SlowClient as e:
+                print(f"Dropping slow client {info.player_id}: {e}")
+                slow_disconnects.inc()
+                client.transport.abort()  # close() would wait for the backlog to flush
+                disconnected.append(client)
+            except Exception:
+                send_failures.inc()
+                # Closing it ends handle_client, which removes the player from the room
+                client.transport.abort()
+                disconnected.append(client)
+
+        for transport, (count, size) in sent.items():
+            if count:
+                messages_out.inc(count, transport=transport)
+                bytes_out.inc(size, transport=transport)
+
+        # Remove disconnected clients
+        for client in disconnected:
+            self.clients.pop(client, None)
+
+    def receive(self, player_id, state):
+        """Take a player's newest state for the next tick.
+
+        The race order follows every state received, not just the last one
+        before a tick, so a finish is never lost behind the next update.
+        """
+        self.latest_inputs[player_id] = state
+        if self.standings.update(player_id, state):
+            self.announce_finish(player_id)
+
+    def run_tick(self):
+        """Apply the latest inputs and broadcast one world snapshot"""
+        self.players.update(self.latest_inputs)
+        self.latest_inputs.clear()
+        self.current_tick += 1
+        snapshot = snapshots.quantize_players(self.players)
+        self.history.add(self.current_tick, snapshot)
+        # Leaders still racing: finishers no longer need the full rate
+        self.interest.update(self.current_tick, snapshot, self.standings.leaders(self.interest.leaders))
+        if self.recorder is not None:
+            self.recorder.record(self.current_tick, snapshot)
+        if self.clients:
+            start = time.perf_counter()
+            self.broadcast(self.current_tick, snapshot, self.players)
+            broadcast_seconds.observe(time.perf_counter() - start)
+
+    def announce_finish(self, player_id):
+        place = len(self.standings.finishers)
+        print(f"Player {player_id} finished in place {place} in room '{self.name}'")
+        self.events.append(protocol.encode_json({"winner": self.standings.winner,
+                                                 "positions": self.standings.positions()}))
+
+    async def tick_loop(self):
+        stats = self.tick_stats
+        interval = 1.0 / self.tick_rate
+        next_tick = time.perf_counter()
+        next_report = next_tick + STATS_INTERVAL
+        while True:
+            start = time.perf_counter()
+            try:
+                self.run_tick()
+            except Exception as e:
+                # One bad tick must not stop the room for everyone in it
+                tick_errors.inc()
+                print(f"Room '{self.name}' tick {self.current_tick} failed: {e!r}")
+            end = time.perf_counter()
+            stats.record(end - start)
+            tick_seconds.observe(end - start)
+
+            next_tick += interval
+            if end > next_tick:
+                # The tick ran past its slot: drop the missed slots instead of
+                # bursting to catch up
+                stats.overruns += 1
+                missed = int((end - next_tick) // interval) + 1
+                stats.skipped += missed - 1
+                next_tick += missed * interval
+
+            if end >= next_report:
+                if stats.ticks and self.clients:
+                    print(f"Room '{self.name}' tick stats ({self.tick_rate} Hz): {stats.summary()}")
+                stats.reset()
+                next_report = end + STATS_INTERVAL
+
+            await asyncio.sleep(max(0.0, next_tick - time.perf_counter()))
+
+def join_room(name):
+    """Return the room called name, opening it if needed"""
+    room = rooms.get(name)
+    if room is None:
+        room = rooms[name] = Room(name, tick_rate)
+        room.start()
+        print(f"Room '{name}' opened")
+    return room
+
+def leave_room(room, conn, player_id):
+    room.remove(conn, player_id)
+    if not room.clients and rooms.get(room.name) is room:
+        room.stop()
+        del rooms[room.name]
+        print(f"Room '{room.name}' closed")
+
+def json_state(obj):
+    """Normalise a state sent as JSON into the dict a binary state decodes to.
+
+    Whatever a JSON client sends, the tick only ever sees well-formed states;
+    anything that does not fit is a decode error (ValueError).
+    """
+    try:
+        return protocol.state_from_fields(*protocol.state_fields(obj))
+    except (TypeError, AttributeError, KeyError, IndexError, OverflowError) as e:
+        raise ValueError(f"malformed player state: {e!r}") from e
+
+def handle_frame(info, kind, payload):
+    """Apply one frame received from a client over TCP or UDP"""
+    info.last_seen = time.monotonic()
+    # Only the newest input is kept; the tick loop applies it and
+    # broadcasts the resulting snapshot to everyone.
+    if kind == protocol.MSG_STATE:
+        info.room.receive(info.player_id, protocol.decode_state(payload))
+    elif kind == protocol.MSG_JSON:
+        info.room.receive(info.player_id, json_state(protocol.decode_json(payload)))
+    elif kind == protocol.MSG_ACK:
+        info.acked_tick = max(info.acked_tick, protocol.decode_ack(payload))
+
+class MovementProtocol(asyncio.DatagramProtocol):
+    """UDP endpoint for the loss-tolerant movement stream"""
 
-def broadcast(message):
-    """Send data to all connected clients"""
-    disconnected = []
-    for client in clients:
+    def datagram_received(self, data, addr):
         try:
-            client.send(message)
-        except:
-            disconnected.append(client)
-    
-    # Remove disconnected clients
-    for client in disconnected:
-        if client in clients:
-            clients.remove(client)
-
-def handle_client(conn, addr):
+            player_id, token, sequence, frames = protocol.decode_datagram(data)
+        except protocol.DECODE_ERRORS:
+            decode_errors.inc(transport="udp")
+            return
+        info = udp_clients.get(player_id)
+        if info is None or token != info.udp_token:
+            return
+        if sequence <= info.udp_sequence:
+            return  # Stale or duplicated: a newer state already arrived
+        info.udp_sequence = sequence
+        info.udp_addr = addr
+        info.received(len(data), "udp")
+        for kind, payload in frames:
+            try:
+                handle_frame(info, kind, payload)
+            except protocol.DECODE_ERRORS as e:
+                decode_errors.inc(transport="udp")
+                print(f"Data error from {addr} (UDP): {e}")
+
+async def negotiate(reader, writer, player_id, hello=None):
+    """Read the client's HELLO, join its room and answer with the accepted format, id and UDP token.
+
+    hello is the HELLO payload when the lobby already read it.
+    """
+    if hello is None:
+        kind, hello = await protocol.read_frame(reader, CLIENT_TIMEOUT)
+        if kind != protocol.MSG_HELLO:
+            raise ValueError(f"expected HELLO, got message kind {kind}")
+    request = protocol.decode_hello(hello)
+    fmt = request.format
+    if fmt not in (protocol.FORMAT_JSON, protocol.FORMAT_BINARY):
+        fmt = protocol.FORMAT_JSON
+    room_name = request.room or protocol.DEFAULT_ROOM
+    room = rooms.get(room_name)
+    if room is not None and room.is_full():
+        raise ValueError(f"room '{room_name}' is full")
+    room = join_room(room_name)
+    info = ClientInfo(fmt, player_id, room, writer.transport)
+    room.clients[writer] = info
+    reply_flags = 0
+    # Deltas are only sent as datagrams in the binary format
+    if request.flags & protocol.HELLO_UDP and fmt == protocol.FORMAT_BINARY and udp_transport is not None:
+        info.udp_token = secrets.randbits(32) or 1
+        udp_clients[player_id] = info
+        reply_flags = protocol.HELLO_UDP
+    try:
+        writer.write(protocol.encode_hello(fmt, player_id, reply_flags, info.udp_token, udp_port, room_name))
+        await writer.drain()
+    except Exception:
+        leave_room(room, writer, player_id)
+        raise
+    return info
+
+async def handle_client(reader, writer, hello=None):
     global next_id
+    addr = writer.get_extra_info('peername')
     player_id = next_id
     next_id += 1
     player_ids[addr] = player_id
-    clients.append(conn)
-    
+
     print(f"New connection from {addr}, assigned ID: {player_id}")
-    last_received = time.time()
-    buffer = ""
-    
-    # Set socket timeout
-    conn.settimeout(1.0)  # 1 second timeout for socket operations
-    
+    accepted_counter.inc()
+
+    info = None
+    try:
+        info = await negotiate(reader, writer, player_id, hello)
+    except Exception as e:
+        print(f"Handshake failed with {addr}: {e}")
+        handshake_failures.inc()
+        cleanup_client(writer, addr, player_id, info)
+        return
+    print(f"Player {player_id} joined room '{info.room.name}'")
+
     while True:
         try:
-            data = conn.recv(4096)
-            if not data:
-                print(f"No data received from {addr}")
-                break
-                
-            last_received = time.time()
+            kind, payload = await protocol.read_frame(reader, CLIENT_TIMEOUT)
+            info.received(protocol.HEADER.size + len(payload), "tcp")
+
             try:
-                buffer += data.decode()
-                player_data = json.loads(buffer)
-                buffer = ""
-                players[player_id] = player_data
-                
-                # Send acknowledgment back to client
-                try:
-                    response = json.dumps({"status": "ok", "players": players})
-                    conn.send(response.encode())
-                except:
-                    print(f"Failed to send response to {addr}")
-                    break
-                
-            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                handle_frame(info, kind, payload)
+            except protocol.DECODE_ERRORS as e:
+                decode_errors.inc(transport="tcp")
                 print(f"Data error from {addr}: {e}")
                 continue
-            
-        except socket.timeout:
-            # Check if client is still active
-            if time.time() - last_received > 10:  # Increased timeout to 10 seconds
-                print(f"Client {addr} inactive for too long")
-                break
-            continue
-            
+
+        except asyncio.IncompleteReadError:
+            print(f"No data received from {addr}")
+            break
+
+        except asyncio.TimeoutError:
+            if time.monotonic() - info.last_seen < CLIENT_TIMEOUT:
+                continue  # Still sending movement over UDP
+            print(f"Client {addr} inactive for too long")
+            break
+
         except ConnectionError as e:
             print(f"Connection lost with {addr}: {e}")
             break
-            
+
         except Exception as e:
             print(f"Unexpected error with {addr}: {e}")
             break
-    
-    cleanup_client(conn, addr, player_id)
-
-def cleanup_client(conn, addr, player_id):
-    if conn in clients:
-        clients.remove(conn)
-    if player_id in players:
-        del players[player_id]
+
+    cleanup_client(writer, addr, player_id, info)
+
+def cleanup_client(conn, addr, player_id, info=None):
+    if info is not None:
+        leave_room(info.room, conn, player_id)
+    udp_clients.pop(player_id, None)
     if addr in player_ids:
         del player_ids[addr]
     try:
         conn.close()
-    except:
+    except Exception:
         pass
-    # Notify remaining clients about player disconnect
-    response = json.dumps(players)
-    broadcast(response.encode())
+    # Remaining clients learn about the disconnect from the next snapshot
+
+def connections_page():
+    """Per-connection traffic, one tab-separated line per client"""
+    now = time.monotonic()
+    lines = ["player\troom\ttransport\tmessages_in\tbytes_in\tmessages_out\tbytes_out\tdropped\tqueued\t"
+             "acked_tick\tidle_s"]
+    for room in rooms.values():
+        for info in room.clients.values():
+            transport = "udp" if info.udp_addr is not None else "tcp"
+            dropped, queued = (info.outbox.dropped, len(info.outbox.queue)) if info.outbox is not None else (0, 0)
+            lines.append(f"{info.player_id}\t{room.name}\t{transport}\t{info.messages_in}\t{info.bytes_in}\t"
+                         f"{info.messages_out}\t{info.bytes_out}\t{dropped}\t{queued}\t"
+                         f"{info.acked_tick}\t{now - info.last_seen:.1f}")
+    return "\n".join(lines) + "\n"
+
+async def metrics_log(interval, label):
+    """Print one line of rates every interval seconds"""
+    def totals():
+        return (messages_in.total(), bytes_in.total(), messages_out.total(), bytes_out.total(),
+                tick_seconds.count, tick_seconds.sum, send_failures.total(), decode_errors.total())
+
+    previous = totals()
+    while True:
+        await asyncio.sleep(interval)
+        current = totals()
+        d = [b - a for a, b in zip(previous, current)]
+        previous = current
+        tick_ms = d[5] / d[4] * 1000 if d[4] else 0.0
+        print(f"{label}: {connections_gauge.total()} connections in {rooms_gauge.total()} rooms | "
+              f"in {d[0] / interval:.0f} msg/s {d[1] / interval / 1024:.1f} KB/s | "
+              f"out {d[2] / interval:.0f} msg/s {d[3] / interval / 1024:.1f} KB/s | "
+              f"tick avg {tick_ms:.2f} ms | {d[6]} send failures, {d[7]} decode errors")
+
+async def start_metrics(port=None, log_interval=0, label="Metrics"):
+    """Start the HTTP endpoint and/or the periodic log line; returns a function that stops them"""
+    http = logger = None
+    if port:
+        pages = {"/metrics": registry.render, "/connections": connections_page}
+        http = await metrics.start_http_server(pages, METRICS_HOST, port)
+        print(f"{label} on http://{METRICS_HOST}:{port}/metrics")
+    if log_interval:
+        logger = asyncio.create_task(metrics_log(log_interval, label))
 
-print(f"Server started on {SERVER_IP}:{SERVER_PORT}, waiting for connections...")
-while True:
+    def stop():
+        if http is not None:
+            http.close()
+        if logger is not None:
+            logger.cancel()
+    return stop
+
+async def open_udp(host, port):
+    global udp_transport, udp_port
+    loop = asyncio.get_running_loop()
+    udp_transport, _ = await loop.create_datagram_endpoint(MovementProtocol, local_addr=(host, port))
+    udp_port = port
+
+async def main(host=SERVER_IP, port=SERVER_PORT, rate=TICK_RATE, udp=True, metrics_port=None, metrics_log=0,
+               record=None):
+    """Single-process server: accepts connections and runs every room itself"""
+    global tick_rate, record_dir
+    tick_rate = rate
+    record_dir = record
+    server = await asyncio.start_server(handle_client, host, port, reuse_address=True)
+    if udp:
+        await open_udp(host, port)
+    stop_metrics = await start_metrics(metrics_port, metrics_log)
+    print(f"Server started on {host}:{port} at {rate} Hz"
+          f"{' with UDP movement' if udp else ''}, waiting for connections...")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        stop_metrics()
+        for room in list(rooms.values()):
+            room.stop()
+        if udp_transport is not None:
+            udp_transport.close()
+
+# ----------------------------------------------------------------
+#                   LOBBY Y PROCESOS DE TRABAJO
+# ----------------------------------------------------------------
+# With --workers N the race rooms are sharded over N processes. The lobby
+# process owns the listening port: it reads each client's HELLO, picks the
+# worker that hosts the requested room and passes it the connected socket
+# (and the HELLO it already consumed) over a Unix socket pair. The kernel
+# alone cannot do this routing (SO_REUSEPORT balances connections, not
+# rooms), so every player of a room ends up in the same process. Worker i
+# receives movement datagrams on port + i and serves its own metrics on
+# metrics port + i.
+
+def room_shard(name, workers):
+    """Index of the worker that hosts a room; stable across processes"""
+    return zlib.crc32(name.encode("utf-8")) % workers
+
+async def read_exactly(loop, sock, size):
+    """Read exactly size bytes, never more, so nothing meant for the worker is consumed"""
+    data = b""
+    while len(data) < size:
+        chunk = await loop.sock_recv(sock, size - len(data))
+        if not chunk:
+            raise asyncio.IncompleteReadError(data, size)
+        data += chunk
+    return data
+
+async def read_hello(loop, sock):
+    header = await asyncio.wait_for(read_exactly(loop, sock, protocol.HEADER.size), CLIENT_TIMEOUT)
+    length, kind = protocol.HEADER.unpack(header)
+    if kind != protocol.MSG_HELLO:
+        raise ValueError(f"expected HELLO, got message kind {kind}")
+    return await asyncio.wait_for(read_exactly(loop, sock, length), CLIENT_TIMEOUT)
+
+async def hand_off(loop, conn, addr, channels):
     try:
-        conn, addr = server.accept()
-        thread = threading.Thread(target=handle_client, args=(conn, addr))
-        thread.start()
+        hello = await read_hello(loop, conn)
+        room = protocol.decode_hello(hello).room or protocol.DEFAULT_ROOM
+        worker = room_shard(room, len(channels))
+        socket.send_fds(channels[worker], [hello], [conn.fileno()])
+        print(f"{addr} -> room '{room}' on worker {worker}")
     except Exception as e:
-        print(f"Error accepting connection: {e}")
-        time.sleep(1)  # Prevent CPU spike on repeated errors
+        print(f"Handshake failed with {addr}: {e}")
+    finally:
+        conn.close()  # The worker holds its own copy of the socket
+
+async def lobby(host, port, channels):
+    loop = asyncio.get_running_loop()
+    listener = socket.create_server((host, port))
+    listener.setblocking(False)
+    print(f"Lobby listening on {host}:{port} with {len(channels)} worker processes")
+    pending = set()
+    with listener:
+        while True:
+            conn, addr = await loop.sock_accept(listener)
+            task = asyncio.create_task(hand_off(loop, conn, addr, channels))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+async def worker_main(index, channel, host, port, rate, udp, metrics_port=None, metrics_log=0, record=None):
+    """Run the rooms of one worker, serving connections handed over by the lobby"""
+    global tick_rate, record_dir
+    tick_rate = rate
+    record_dir = record
+    if udp:
+        await open_udp(host, port)
+    stop_metrics = await start_metrics(metrics_port, metrics_log, f"Worker {index} metrics")
+    loop = asyncio.get_running_loop()
+    pending = set()
+
+    async def serve(conn, hello):
+        reader, writer = await asyncio.open_connection(sock=conn)
+        await handle_client(reader, writer, hello)
+
+    def on_hand_off():
+        try:
+            hello, fds, _, _ = socket.recv_fds(channel, protocol.MAX_PAYLOAD, 1)
+        except BlockingIOError:
+            return
+        for fd in fds:
+            task = asyncio.create_task(serve(socket.socket(fileno=fd), hello))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+    channel.setblocking(False)
+    loop.add_reader(channel.fileno(), on_hand_off)
+    print(f"Worker {index} running at {rate} Hz{f' with UDP movement on port {port}' if udp else ''}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        stop_metrics()
+        for room in list(rooms.values()):
+            room.stop()
+        if udp_transport is not None:
+            udp_transport.close()
+
+def run_worker(index, channel, host, port, rate, udp, metrics_port=None, metrics_log=0, record=None):
+    try:
+        asyncio.run(worker_main(index, channel, host, port, rate, udp, metrics_port, metrics_log, record))
+    except KeyboardInterrupt:
+        pass
+
+def run_workers(host, port, rate, udp, workers, metrics_port=None, metrics_log=0, record=None):
+    channels = []
+    processes = []
+    for index in range(workers):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        worker_metrics_port = metrics_port + index if metrics_port else None
+        process = multiprocessing.Process(target=run_worker, daemon=True,
+                                          args=(index, child, host, port + index, rate, udp,
+                                                worker_metrics_port, metrics_log, record))
+        process.start()
+        child.close()
+        channels.append(parent)
+        processes.append(process)
+    try:
+        asyncio.run(lobby(host, port, channels))
+    finally:
+        for process in processes:
+            process.terminate()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Racing game server")
+    parser.add_argument("--host", default=SERVER_IP)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE,
+                        help="snapshots per second (e.g. 20, 30, 60)")
+    parser.add_argument("--no-udp", action="store_true",
+                        help="keep the movement stream on TCP")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes to shard race rooms over (UDP uses port .. port + workers - 1)")
+    parser.add_argument("--metrics-port", type=int,
+                        help=f"serve /metrics and /connections on {METRICS_HOST} (workers use port + index)")
+    parser.add_argument("--metrics-log", type=float, default=0,
+                        help="seconds between metrics log lines (0: off)")
+    parser.add_argument("--record", metavar="DIR",
+                        help="write a replay of every room to this directory (see replay.py)")
+    args = parser.parse_args()
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+    if args.workers > 1 and not hasattr(socket, "send_fds"):
+        parser.error("--workers needs Unix socket passing (Linux/macOS)")
+    try:
+        if args.workers > 1:
+            run_workers(args.host, args.port, args.tick_rate, not args.no_udp, args.workers,
+                        args.metrics_port, args.metrics_log, args.record)
+        else:
+            asyncio.run(main(args.host, args.port, args.tick_rate, not args.no_udp,
+                             args.metrics_port, args.metrics_log, args.record))
+    except KeyboardInterrupt:
+        pass
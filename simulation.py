@@ -0,0 +1,229 @@
+import math
+from collections import namedtuple
+
+import track
+from spatial import SpatialHash, rects_overlap
+
+# ----------------------------------------------------------------
+#                   FÍSICA
+# ----------------------------------------------------------------
+ACCELERATION = 0.1
+TURNING_SPEED = 4.0
+FRICTION = 0.01
+MAX_SPEED = 9.5
+DRIFT_FACTOR = 0.55
+GRASS_SLOWDOWN = 0.4
+
+# The constants above are tuned per frame at this rate; step() scales them
+# by dt * PHYSICS_FPS, so a step of 1 / PHYSICS_FPS is exactly one old frame.
+PHYSICS_FPS = 60
+
+START_ANGLE = 90
+MAX_LAPS = 3
+EXPLOSION_DURATION = 0.5
+CONTACT_DAMPING = 0.5   # Speed kept after bumping into another car
+
+# ----------------------------------------------------------------
+#                   SIMULACIÓN SIN PANTALLA
+# ----------------------------------------------------------------
+# Display-free race simulation: no pygame, no wall clock unless one is
+# injected. step() advances one car by a fixed timestep and returns the
+# race events it produced, so races can be run faster than real time for
+# tests, replays, server-side validation and bots.
+
+Inputs = namedtuple("Inputs", "left right up down", defaults=(False, False, False, False))
+NO_INPUT = Inputs()
+
+# Events returned by step(): (kind, value)
+EVENT_CHECKPOINT = "checkpoint"   # value: checkpoint number reached (1-based)
+EVENT_LAP = "lap"                 # value: lap time in seconds
+EVENT_FINISHED = "finished"       # value: total race time in seconds
+EVENT_BOMB = "bomb"               # value: center of the bomb that was hit
+
+# Keys of the static objects in World.hazards
+CHECKPOINT = "checkpoint"   # (CHECKPOINT, index)
+BOMB = "bomb"               # (BOMB, index)
+FINISH_LINE = ("finish", 0)
+
+
+def car_rect(position, size=track.CAR_SIZE):
+    """Axis-aligned collision rect of a car, truncated like pygame.Rect"""
+    width, height = size
+    return (int(position[0] - width / 2), int(position[1] - height / 2), width, height)
+
+def rect_center(rect):
+    return (rect[0] + rect[2] // 2, rect[1] + rect[3] // 2)
+
+
+class World:
+    """Static race layout: collision field, checkpoints, finish line and bombs"""
+
+    def __init__(self, field=None, checkpoints=None, finish_line=None, bombs=None,
+                 start_position=None, max_laps=MAX_LAPS, size=track.FIELD_SIZE, car_size=track.CAR_SIZE):
+        self.size = size
+        self.car_size = car_size
+        self.field = field if field is not None else track.TrackField.from_polygons(size=size, car_size=car_size)
+        self.checkpoints = [tuple(r) for r in (track.checkpoints if checkpoints is None else checkpoints)]
+        self.finish_line = tuple(track.finish_line if finish_line is None else finish_line)
+        self.bombs = [tuple(r) for r in (track.bombs if bombs is None else bombs)]
+        self.start_position = list(track.start_position if start_position is None else start_position)
+        self.max_laps = max_laps
+
+        self.hazards = SpatialHash()
+        for i, rect in enumerate(self.checkpoints):
+            self.hazards.insert((CHECKPOINT, i), rect)
+        for i, rect in enumerate(self.bombs):
+            self.hazards.insert((BOMB, i), rect)
+        self.hazards.insert(FINISH_LINE, self.finish_line)
+
+_default_world = None
+
+def default_world():
+    """The shared World for track.py, built on first use"""
+    global _default_world
+    if _default_world is None:
+        _default_world = World()
+    return _default_world
+
+
+class CarState:
+    """Everything step() needs to know about one car and its race progress"""
+
+    def __init__(self, x, y, angle=START_ANGLE, now=0.0):
+        self.position = [x, y]
+        self.velocity = [0, 0]
+        self.angle = angle
+        self.speed = 0
+        self.acceleration_time = 0
+        self.on_track = True
+
+        self.time = now  # Simulation clock, advanced by step()
+        self.lap_count = 0
+        self.checkpoint_index = 0
+        self.checkpoint_hit = False
+        self.lap_times = []
+        self.best_lap = float('inf')
+        self.current_lap_start = now
+        self.last_lap_time = 0
+        self.finished = False
+        self.total_time = 0
+
+        self.explosion_pos = None
+        self.explosion_start = 0
+
+
+def step(state, inputs, dt, world=None, clock=None):
+    """Advance one car by dt seconds and return the list of race events.
+
+    Lap timing uses the simulation clock (state.time) unless a clock
+    callable is injected, e.g. time.time for a real-time client.
+    """
+    world = world or default_world()
+    state.time += dt
+    now = clock() if clock is not None else state.time
+    frames = dt * PHYSICS_FPS
+    events = []
+
+    # Controles del coche
+    turn = TURNING_SPEED * 1.2 * frames
+    if inputs.left:
+        state.angle += turn
+    if inputs.right:
+        state.angle -= turn
+    if inputs.up:
+        state.acceleration_time += dt
+        acceleration = ACCELERATION * min(state.acceleration_time, 3.0) * frames
+        state.speed = min(state.speed + acceleration, MAX_SPEED)
+    elif inputs.down:
+        state.acceleration_time += dt
+        deceleration = ACCELERATION * min(state.acceleration_time, 2.0) * frames
+        state.speed = max(state.speed - deceleration, -MAX_SPEED / 2.5)
+    else:
+        state.acceleration_time = 0
+        state.speed *= (1 - FRICTION * 1.5) ** frames
+
+    # Física de pista/césped
+    state.on_track = world.field.on_track(state.position[0], state.position[1], state.angle)
+    if state.on_track:
+        state.speed *= (1 - FRICTION) ** frames
+    else:
+        state.speed *= (1 - FRICTION - GRASS_SLOWDOWN) ** frames
+
+    # Actualizar posición
+    angle_rad = math.radians(state.angle)
+    state.velocity[0] = math.sin(angle_rad) * state.speed
+    state.velocity[1] = math.cos(angle_rad) * state.speed
+    state.position[0] += state.velocity[0] * frames
+    state.position[1] += state.velocity[1] * frames
+
+    # Limitar a la pantalla
+    state.position[0] = max(0, min(state.position[0], world.size[0]))
+    state.position[1] = max(0, min(state.position[1], world.size[1]))
+
+    player_rect = car_rect(state.position, world.car_size)
+    touching = set(world.hazards.query(player_rect))
+
+    # Checkpoints
+    if state.checkpoint_index < len(world.checkpoints):
+        if (CHECKPOINT, state.checkpoint_index) in touching:
+            if not state.checkpoint_hit:
+                state.checkpoint_hit = True
+                state.checkpoint_index += 1
+                events.append((EVENT_CHECKPOINT, state.checkpoint_index))
+        else:
+            state.checkpoint_hit = False
+
+    # Meta
+    if state.checkpoint_index >= len(world.checkpoints) and FINISH_LINE in touching:
+        state.lap_count += 1
+        lap_time = now - state.current_lap_start
+        state.last_lap_time = lap_time
+        state.lap_times.append(lap_time)
+        state.best_lap = min(state.best_lap, lap_time)
+        state.checkpoint_index = 0
+        state.current_lap_start = now
+        events.append((EVENT_LAP, lap_time))
+
+        if state.lap_count >= world.max_laps:
+            state.finished = True
+            state.total_time = sum(state.lap_times)
+            state.speed = 0
+            events.append((EVENT_FINISHED, state.total_time))
+
+    # Colisión con bombas
+    if state.explosion_pos is not None and now - state.explosion_start >= EXPLOSION_DURATION:
+        state.explosion_pos = None
+    if state.explosion_pos is None:
+        for kind, index in sorted(key for key in touching if key[0] == BOMB):
+            state.speed = 0
+            state.position = list(world.start_position)
+            state.angle = START_ANGLE
+            state.explosion_pos = rect_center(world.bombs[index])
+            state.explosion_start = now
+            events.append((EVENT_BOMB, state.explosion_pos))
+            break
+
+    return events
+
+
+def push_apart(state, other_position, world=None, tie=1):
+    """Resolve a bump with another car: move this car out of the overlap.
+
+    Each car moves half of the overlap along the shallower axis, so two
+    clients resolving the same contact end up just touching. tie (+1 or -1)
+    is the direction used when both cars are level on that axis; the two
+    cars must pass opposite values. Returns True if the cars were overlapping.
+    """
+    world = world or default_world()
+    a = car_rect(state.position, world.car_size)
+    b = car_rect(other_position, world.car_size)
+    if not rects_overlap(a, b):
+        return False
+    overlap_x = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    overlap_y = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    axis, overlap = (0, overlap_x) if overlap_x < overlap_y else (1, overlap_y)
+    offset = state.position[axis] - other_position[axis]
+    direction = tie if offset == 0 else (1 if offset > 0 else -1)
+    state.position[axis] += direction * overlap / 2
+    state.speed *= CONTACT_DAMPING
+    return True
@@ -0,0 +1,169 @@
+import struct
+from functools import lru_cache
+
+import protocol
+
+# ----------------------------------------------------------------
+#                   DELTA SNAPSHOTS
+# ----------------------------------------------------------------
+# A snapshot is {player_id: field tuple}, where the tuple is the quantized
+# STATE layout from protocol.py (x, y, angle, lap, checkpoint, flags).
+# The server encodes each tick against the newest snapshot the client has
+# acknowledged and only sends the players and fields that changed.
+#
+# MSG_DELTA payload:
+#   DELTA_HEADER (tick, baseline tick, changed count, removed count)
+#   changed entries: player id, field mask, then only the masked fields
+#   removed player ids
+# A baseline tick of 0 means "no baseline": every field is sent.
+
+DELTA_HEADER = struct.Struct("!IIHH")
+ENTRY_HEADER = struct.Struct("!HB")    # player id, field mask
+PLAYER_ID = struct.Struct("!H")
+
+FIELD_CODES = "HHHBBB"                 # Same order as protocol.STATE
+FULL_MASK = (1 << len(FIELD_CODES)) - 1
+
+NO_BASELINE = 0
+HISTORY_SIZE = 64  # Ticks of snapshots kept as possible baselines
+
+
+@lru_cache(maxsize=None)
+def _fields_struct(mask):
+    return struct.Struct("!" + "".join(code for bit, code in enumerate(FIELD_CODES) if mask >> bit & 1))
+
+def quantize_players(players):
+    """Build a snapshot from the server's {player_id: state dict} table"""
+    return {int(player_id): protocol.state_fields(data) for player_id, data in players.items()}
+
+def snapshot_to_players(snapshot):
+    """Expand a snapshot back into {player_id: state dict}"""
+    return {player_id: protocol.state_from_fields(*fields) for player_id, fields in snapshot.items()}
+
+
+def _encode_entry(player_id, old, fields):
+    if old is None:
+        mask = FULL_MASK
+    else:
+        mask = 0
+        for bit, (a, b) in enumerate(zip(fields, old)):
+            if a != b:
+                mask |= 1 << bit
+    values = [value for bit, value in enumerate(fields) if mask >> bit & 1]
+    return ENTRY_HEADER.pack(player_id, mask) + _fields_struct(mask).pack(*values)
+
+def encode_delta(tick, snapshot, baseline_tick=NO_BASELINE, baseline=None, entries=None):
+    """Encode the difference between a baseline snapshot and the current one as a frame
+
+    entries, if given, caches encoded players by (player id, old fields, new
+    fields), so clients whose deltas overlap share the work.
+    """
+    baseline = baseline or {}
+    parts = []
+    for player_id, fields in snapshot.items():
+        old = baseline.get(player_id)
+        if old == fields:
+            continue
+        if entries is None:
+            parts.append(_encode_entry(player_id, old, fields))
+            continue
+        key = (player_id, old, fields)
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = _encode_entry(player_id, old, fields)
+        parts.append(entry)
+    changed = len(parts)
+
+    removed = [player_id for player_id in baseline if player_id not in snapshot]
+    for player_id in removed:
+        parts.append(PLAYER_ID.pack(player_id))
+
+    header = DELTA_HEADER.pack(tick, baseline_tick, changed, len(removed))
+    return protocol.frame(protocol.MSG_DELTA, header + b"".join(parts))
+
+def decode_delta(payload):
+    """Split a MSG_DELTA payload into (tick, baseline tick, changes, removed ids)
+
+    changes maps player id to (mask, values) with only the masked fields.
+    """
+    tick, baseline_tick, changed, removed_count = DELTA_HEADER.unpack_from(payload)
+    offset = DELTA_HEADER.size
+    changes = {}
+    for _ in range(changed):
+        player_id, mask = ENTRY_HEADER.unpack_from(payload, offset)
+        offset += ENTRY_HEADER.size
+        fields = _fields_struct(mask)
+        changes[player_id] = (mask, fields.unpack_from(payload, offset))
+        offset += fields.size
+    removed = []
+    for _ in range(removed_count):
+        removed.append(PLAYER_ID.unpack_from(payload, offset)[0])
+        offset += PLAYER_ID.size
+    return tick, baseline_tick, changes, removed
+
+def apply_delta(baseline, changes, removed):
+    """Return the snapshot obtained by applying decoded changes to a baseline"""
+    snapshot = dict(baseline)
+    for player_id in removed:
+        snapshot.pop(player_id, None)
+    for player_id, (mask, values) in changes.items():
+        if mask == FULL_MASK:
+            snapshot[player_id] = tuple(values)
+            continue
+        fields = list(snapshot.get(player_id, (0,) * len(FIELD_CODES)))
+        it = iter(values)
+        for bit in range(len(FIELD_CODES)):
+            if mask >> bit & 1:
+                fields[bit] = next(it)
+        snapshot[player_id] = tuple(fields)
+    return snapshot
+
+
+class SnapshotHistory:
+    """The last HISTORY_SIZE snapshots, keyed by tick"""
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self.snapshots = {}
+
+    def add(self, tick, snapshot):
+        """Store a snapshot; ticks are added in increasing order, so the oldest come first"""
+        snapshots = self.snapshots
+        snapshots[tick] = snapshot
+        cutoff = tick - self.size
+        oldest = next(iter(snapshots))
+        while oldest <= cutoff:
+            del snapshots[oldest]
+            oldest = next(iter(snapshots))
+
+    def get(self, tick):
+        if tick == NO_BASELINE:
+            return {}
+        return self.snapshots.get(tick)
+
+
+class DeltaReceiver:
+    """Client side: rebuilds snapshots from deltas and tracks what to acknowledge"""
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.history = SnapshotHistory(size)
+        self.last_tick = NO_BASELINE
+
+    def receive(self, payload):
+        """Apply a MSG_DELTA payload; returns ({player_id: state dict}, changed ids), or None if unusable
+
+        changed holds the players whose state differs from the previous
+        snapshot received (all of them for the first one).
+        """
+        tick, baseline_tick, changes, removed = decode_delta(payload)
+        baseline = self.history.get(baseline_tick)
+        if baseline is None or tick <= self.last_tick:
+            # Baseline already forgotten or an out-of-date delta: wait for the
+            # server to fall back to an older baseline or a full snapshot
+            return None
+        snapshot = apply_delta(baseline, changes, removed)
+        previous = self.history.get(self.last_tick) or {}
+        changed = {player_id for player_id, fields in snapshot.items() if previous.get(player_id) != fields}
+        self.history.add(tick, snapshot)
+        self.last_tick = tick
+        return snapshot_to_players(snapshot), changed
@@ -0,0 +1,90 @@
+from collections import defaultdict
+
+# ----------------------------------------------------------------
+#                   ÍNDICE ESPACIAL
+# ----------------------------------------------------------------
+# Uniform grid over the track: every object is registered in the cells its
+# rect covers, so "what does this rect overlap" only looks at the few
+# objects sharing those cells instead of scanning every checkpoint, bomb
+# and car. Static objects are inserted once; moving cars are re-bucketed
+# with move(), which only touches the grid when they change cells.
+# Rects are (x, y, width, height) tuples.
+
+CELL_SIZE = 64  # Bigger than a car, so a car covers at most 2x2 cells
+
+
+def rects_overlap(a, b):
+    """Same test as pygame.Rect.colliderect for (x, y, w, h) tuples"""
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+class SpatialHash:
+    """Uniform-grid index of keyed rects"""
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)  # (cx, cy) -> keys
+        self.rects = {}                # key -> rect
+        self.spans = {}                # key -> (cx0, cy0, cx1, cy1)
+
+    def __len__(self):
+        return len(self.rects)
+
+    def __contains__(self, key):
+        return key in self.rects
+
+    def keys(self):
+        return self.rects.keys()
+
+    def _span(self, rect):
+        size = self.cell_size
+        x, y, w, h = rect
+        return (int(x // size), int(y // size),
+                int((x + max(w, 1) - 1) // size), int((y + max(h, 1) - 1) // size))
+
+    def _cells(self, span):
+        cx0, cy0, cx1, cy1 = span
+        return [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+
+    def insert(self, key, rect):
+        self.move(key, rect)
+
+    def move(self, key, rect):
+        """Insert key or update its rect, re-bucketing only if its cells changed"""
+        span = self._span(rect)
+        old_span = self.spans.get(key)
+        self.rects[key] = tuple(rect)
+        if span == old_span:
+            return
+        old_cells = set(self._cells(old_span)) if old_span is not None else set()
+        new_cells = set(self._cells(span))
+        for cell in old_cells - new_cells:
+            bucket = self.cells[cell]
+            bucket.discard(key)
+            if not bucket:
+                del self.cells[cell]
+        for cell in new_cells - old_cells:
+            self.cells[cell].add(key)
+        self.spans[key] = span
+
+    def remove(self, key):
+        span = self.spans.pop(key, None)
+        if span is None:
+            return
+        del self.rects[key]
+        for cell in self._cells(span):
+            bucket = self.cells.get(cell)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.cells[cell]
+
+    def query(self, rect, exclude=None):
+        """Keys whose rect overlaps rect (unordered)"""
+        candidates = set()
+        for cell in self._cells(self._span(rect)):
+            bucket = self.cells.get(cell)
+            if bucket:
+                candidates |= bucket
+        candidates.discard(exclude)
+        return [key for key in candidates if rects_overlap(rect, self.rects[key])]
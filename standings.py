@@ -0,0 +1,98 @@
+import bisect
+import math
+
+import simulation
+import track
+
+# ----------------------------------------------------------------
+#                   CLASIFICACIÓN
+# ----------------------------------------------------------------
+# Race order kept sorted as players report their state: finished players
+# first in the order they crossed the line, then everyone else by laps,
+# checkpoints passed and distance to the next checkpoint (or the finish
+# line once all checkpoints of the lap are done). An update moves only
+# that player's entry: O(log n) comparisons to find its old and new place
+# by binary search, plus a pointer memmove in the list, instead of sorting
+# the whole field every tick.
+# A finished flag only counts once the player has driven every lap, and
+# finishing is sticky: later states without the flag do not put a player
+# back in the race.
+
+
+def race_targets(checkpoints=None, finish_line=None):
+    """Centres of the checkpoints in order, then of the finish line"""
+    checkpoints = track.checkpoints if checkpoints is None else checkpoints
+    finish_line = track.finish_line if finish_line is None else finish_line
+    return [(x + w / 2, y + h / 2) for x, y, w, h in list(checkpoints) + [finish_line]]
+
+
+class Standings:
+    """Incrementally sorted race order"""
+
+    def __init__(self, targets=None, laps=simulation.MAX_LAPS):
+        self.targets = race_targets() if targets is None else targets
+        self.laps = laps
+        self.order = []       # Sorted (key, player id)
+        self.keys = {}        # Player id -> current key
+        self.finishers = []   # Player ids in the order they finished
+        self.version = 0      # Bumped whenever the order changes
+
+    def __len__(self):
+        return len(self.order)
+
+    def _key(self, player_id, lap, checkpoint, position, finished):
+        if finished:
+            self.finishers.append(player_id)
+            return (0, len(self.finishers) - 1, 0, 0.0)
+        tx, ty = self.targets[min(checkpoint, len(self.targets) - 1)]
+        return (1, -lap, -checkpoint, math.hypot(tx - position[0], ty - position[1]))
+
+    def _rank(self, entry):
+        return bisect.bisect_left(self.order, entry)
+
+    def update(self, player_id, state):
+        """Apply one player's state dict; returns True if the player just finished"""
+        player_id = int(player_id)
+        old = self.keys.get(player_id)
+        if old is not None and old[0] == 0:
+            return False  # Already finished: the place is final
+        lap = int(state.get("lap", 0))
+        finished = bool(state.get("finished")) and lap >= self.laps
+        key = self._key(player_id, lap, int(state.get("checkpoints", 0)), state.get("position", (0, 0)), finished)
+        if key == old:
+            return False
+        old_rank = None
+        if old is not None:
+            old_rank = self._rank((old, player_id))
+            del self.order[old_rank]
+        entry = (key, player_id)
+        rank = self._rank(entry)
+        self.order.insert(rank, entry)
+        self.keys[player_id] = key
+        if rank != old_rank:
+            self.version += 1
+        return finished
+
+    def remove(self, player_id):
+        key = self.keys.pop(int(player_id), None)
+        if key is not None:
+            del self.order[self._rank((key, int(player_id)))]
+            self.version += 1
+
+    def position(self, player_id):
+        """1-based race position of a player, or None if unknown"""
+        key = self.keys.get(int(player_id))
+        return None if key is None else self._rank((key, int(player_id))) + 1
+
+    def positions(self):
+        """Player ids in race order"""
+        return [player_id for _, player_id in self.order]
+
+    def leaders(self, count):
+        """The first count players still racing (finishers are out of the race)"""
+        start = bisect.bisect_left(self.order, ((1,),))
+        return [player_id for _, player_id in self.order[start:start + count]]
+
+    @property
+    def winner(self):
+        return self.finishers[0] if self.finishers else None
@@ -0,0 +1,25 @@
+import math
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simulation  # noqa: E402
+
+
+def steer(state, world, rng=random):
+    """Bot inputs: turn towards the next checkpoint (or the finish line), mostly on the throttle"""
+    checkpoints = world.checkpoints
+    target = checkpoints[state.checkpoint_index] if state.checkpoint_index < len(checkpoints) else world.finish_line
+    tx, ty = target[0] + target[2] / 2, target[1] + target[3] / 2
+    want = math.degrees(math.atan2(tx - state.position[0], ty - state.position[1]))
+    diff = (want - state.angle + 180) % 360 - 180
+    return simulation.Inputs(left=diff > 3, right=diff < -3, up=abs(diff) < 60 or rng.random() < 0.3, down=False)
+
+
+@pytest.fixture
+def bot():
+    return steer
@@ -0,0 +1,26 @@
+import random
+
+import numpy as np
+
+import batch_physics
+import simulation
+import track
+
+
+def test_step_batch_matches_step(bot):
+    world = simulation.default_world()
+    count = 8
+    cars = [simulation.CarState(*track.start_position) for _ in range(count)]
+    batch = batch_physics.CarBatch(count, track.start_position)
+    rngs = [random.Random(i) for i in range(count)]
+    for i in range(6000):
+        inputs = [bot(car, world, rng) for car, rng in zip(cars, rngs)]
+        for car, car_inputs in zip(cars, inputs):
+            simulation.step(car, car_inputs, 1 / 60, world)
+        keys = np.array(inputs)
+        batch_physics.step_batch(batch, keys[:, 0], keys[:, 1], keys[:, 2], keys[:, 3], 1 / 60, world)
+        assert np.array_equal([car.position for car in cars], batch.positions), i
+        assert np.array_equal([car.lap_count for car in cars], batch.lap_count), i
+        assert np.array_equal([car.checkpoint_index for car in cars], batch.checkpoint_index), i
+    assert batch.finished.any()  # The drive got as far as finishing the race
+    assert np.allclose([car.total_time for car in cars], batch.total_time)
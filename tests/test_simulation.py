@@ -0,0 +1,94 @@
+import math
+import random
+
+import simulation
+import track
+from simulation import ACCELERATION, FRICTION, GRASS_SLOWDOWN, MAX_SPEED, TURNING_SPEED
+
+FPS = 60
+
+
+def overlap(a, b):
+    """pygame.Rect.colliderect on (x, y, w, h) tuples, coordinates truncated like Rect does"""
+    ax, ay, aw, ah = (int(v) for v in a)
+    bx, by, bw, bh = b
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+
+class OldLoop:
+    """The client's per-frame physics before it moved to simulation.step(), one frame per call"""
+
+    def __init__(self, world):
+        self.world = world
+        self.position = list(track.start_position)
+        self.angle = 90
+        self.speed = 0
+        self.acceleration_time = 0
+        self.lap = 0
+        self.checkpoint = 0
+        self.checkpoint_hit = False
+        self.time = 0.0
+        self.explosion = None
+        self.explosions = 0
+
+    def frame(self, inputs):
+        self.time += 1 / FPS
+        if inputs.left:
+            self.angle += TURNING_SPEED * 1.2
+        if inputs.right:
+            self.angle -= TURNING_SPEED * 1.2
+        if inputs.up:
+            self.acceleration_time += 1 / FPS
+            self.speed = min(self.speed + ACCELERATION * min(self.acceleration_time, 3.0), MAX_SPEED)
+        elif inputs.down:
+            self.acceleration_time += 1 / FPS
+            self.speed = max(self.speed - ACCELERATION * min(self.acceleration_time, 2.0), -MAX_SPEED / 2.5)
+        else:
+            self.acceleration_time = 0
+            self.speed *= 1 - FRICTION * 1.5
+        on_track = self.world.field.on_track(self.position[0], self.position[1], self.angle)
+        self.speed *= (1 - FRICTION) if on_track else (1 - FRICTION - GRASS_SLOWDOWN)
+        rad = math.radians(self.angle)
+        self.position[0] = max(0, min(self.position[0] + math.sin(rad) * self.speed, 1441))
+        self.position[1] = max(0, min(self.position[1] + math.cos(rad) * self.speed, 768))
+
+        car = (self.position[0] - 15, self.position[1] - 10, 30, 20)
+        if self.checkpoint < len(track.checkpoints):
+            if overlap(car, track.checkpoints[self.checkpoint]):
+                if not self.checkpoint_hit:
+                    self.checkpoint_hit = True
+                    self.checkpoint += 1
+            else:
+                self.checkpoint_hit = False
+        if self.checkpoint >= len(track.checkpoints) and overlap(car, track.finish_line):
+            self.lap += 1
+            self.checkpoint = 0
+            if self.lap >= simulation.MAX_LAPS:
+                self.speed = 0
+        if self.explosion is not None and self.time - self.explosion >= simulation.EXPLOSION_DURATION:
+            self.explosion = None
+        for bomb in track.bombs:
+            if overlap(car, bomb) and self.explosion is None:
+                self.speed = 0
+                self.position = list(track.start_position)
+                self.angle = 90
+                self.explosion = self.time
+                self.explosions += 1
+
+
+def test_step_matches_the_old_frame_loop(bot):
+    world = simulation.default_world()
+    old = OldLoop(world)
+    state = simulation.CarState(*track.start_position)
+    rng = random.Random(3)
+    for i in range(20000):
+        inputs = bot(state, world, rng)
+        old.frame(inputs)
+        simulation.step(state, inputs, 1 / FPS, world)
+        assert math.isclose(state.position[0], old.position[0], abs_tol=1e-9), i
+        assert math.isclose(state.position[1], old.position[1], abs_tol=1e-9), i
+        assert state.angle == old.angle, i
+        assert (state.lap_count, state.checkpoint_index) == (old.lap, old.checkpoint), i
+    # The drive has to cover what it is checking: laps and bomb resets
+    assert old.lap >= 5
+    assert old.explosions >= 5
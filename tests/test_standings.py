@@ -0,0 +1,58 @@
+import protocol
+import server
+import simulation
+import standings
+
+TARGETS = [(100, 0), (200, 0), (300, 0)]  # Two checkpoints, then the finish line
+
+
+def state(lap=0, checkpoints=0, x=0, finished=False):
+    return {"position": (x, 0), "angle": 0, "lap": lap, "checkpoints": checkpoints, "finished": finished}
+
+
+def test_order_by_lap_checkpoint_and_distance():
+    race = standings.Standings(TARGETS, laps=3)
+    race.update(1, state(lap=0, checkpoints=1, x=120))
+    race.update(2, state(lap=1, checkpoints=0, x=0))
+    race.update(3, state(lap=0, checkpoints=1, x=180))
+    race.update(4, state(lap=0, checkpoints=0, x=90))
+    assert race.positions() == [2, 3, 1, 4]
+    race.update(4, state(lap=1, checkpoints=1, x=150))
+    assert race.positions() == [4, 2, 3, 1]
+    assert race.position(3) == 3
+    race.remove(2)
+    assert race.positions() == [4, 3, 1]
+
+
+def test_finishers_rank_first_in_finishing_order_and_stay_finished():
+    race = standings.Standings(TARGETS, laps=3)
+    race.update(1, state(lap=2, checkpoints=2))
+    race.update(2, state(lap=2, checkpoints=2))
+    race.update(3, state(lap=1))
+    assert race.update(2, state(lap=3, finished=True))
+    assert race.update(1, state(lap=3, finished=True))
+    assert not race.update(2, state(lap=3, x=50))  # A later state without the flag
+    assert race.winner == 2
+    assert race.finishers == [2, 1]
+    assert race.positions() == [2, 1, 3]
+    assert race.leaders(2) == [3]  # Leaders are the cars still racing
+
+
+def test_finished_flag_before_the_last_lap_is_ignored():
+    race = standings.Standings(TARGETS, laps=3)
+    assert not race.update(1, state(lap=0, finished=True))
+    assert race.finishers == []
+    assert race.winner is None
+
+
+def test_room_announces_a_finish_followed_by_a_regular_state():
+    room = server.Room("test")
+    laps = simulation.MAX_LAPS
+    room.receive(1, state(lap=laps, finished=True))
+    room.receive(1, state(lap=laps))  # The next position update, in the same tick
+    room.receive(2, state(lap=1))
+    room.run_tick()
+    assert room.standings.winner == 1
+    assert room.standings.positions() == [1, 2]
+    frames, _ = protocol.split_frames(b"".join(room.events))  # Sent with the next broadcast to clients
+    assert [protocol.decode_json(payload) for _, payload in frames] == [{"winner": 1, "positions": [1]}]
@@ -0,0 +1,151 @@
+import numpy as np
+
+# ----------------------------------------------------------------
+#                   DEFINICIÓN DE PISTA CON OFFSET
+# ----------------------------------------------------------------
+# Plain geometry (no pygame) so the server and headless tools can share it.
+# Rects are (x, y, width, height) tuples.
+
+FIELD_SIZE = (1441, 768)   # Tamaño de la pantalla / mundo
+CAR_SIZE = (30, 20)
+
+offset_y = 70  # Reservamos 70px arriba para el header
+
+track_outer_original = [
+    (50, 50), (1350, 50), (1350, 300),
+    (1050, 300), (1050, 400), (1350, 400),
+    (1350, 600), (550, 600), (400, 450),
+    (250, 450), (150, 550), (50, 450),
+    (50, 50)
+]
+track_inner_original = [
+    (150, 150), (1250, 150), (1250, 200),
+    (950, 200), (950, 500), (1250, 500),
+    (1250, 500), (550, 500), (450, 400),
+    (350, 400), (200, 400), (150, 350),
+    (150, 150)
+]
+
+# Aplicamos offset vertical
+track_outer = [(x, y + offset_y) for x, y in track_outer_original]
+track_inner = [(x, y + offset_y) for x, y in track_inner_original]
+
+# Posición inicial del coche
+start_position_original = [120, 100]
+start_position = [start_position_original[0], start_position_original[1] + offset_y]
+
+# Checkpoints
+checkpoints_original = [
+    (350, 50, 40, 40),
+    (750, 110, 40, 40),
+    (950, 350, 40, 40),
+    (900, 500, 40, 40),
+    (550, 500, 40, 40),
+    (350, 400, 40, 50),
+    (50, 300, 40, 40),
+]
+checkpoints = [(x, y + offset_y, w, h) for x, y, w, h in checkpoints_original]
+
+# Línea de meta
+finish_line_original = (50, 150, 50, 50)
+finish_line = (finish_line_original[0], finish_line_original[1] + offset_y,
+               finish_line_original[2], finish_line_original[3])
+
+# Bombas
+bombs_original = [
+    (300, 100, 10, 10),
+    (1000, 500, 10, 10),
+    (700, 530, 10, 10),
+]
+bombs = [(x, y + offset_y, w, h) for x, y, w, h in bombs_original]
+
+BORDER_WIDTH = 5  # Ancho de las líneas de borde dibujadas sobre la pista
+
+# ----------------------------------------------------------------
+#                   CAMPO DE COLISIÓN
+# ----------------------------------------------------------------
+# The old check rotated a Surface, built a Mask and counted the overlap
+# with the track mask every frame. Instead, the drivable pixels are
+# rasterized once into a boolean grid and the car's rotated footprint is
+# sampled at a fixed set of points; a car is on track when the sampled
+# on-track fraction beats the same 30% overlap threshold.
+
+FOOTPRINT_SCALE = 0.8    # The footprint is 80% of the car sprite
+OVERLAP_RATIO = 0.3      # Overlap (in pixels) needed, relative to the full car size
+FOOTPRINT_SAMPLES = (8, 6)
+
+
+def _inside_polygon(xs, ys, polygon):
+    """Even-odd point-in-polygon test over arrays of coordinates"""
+    inside = np.zeros(np.broadcast(xs, ys).shape, dtype=bool)
+    for (x1, y1), (x2, y2) in zip(polygon, polygon[1:] + polygon[:1]):
+        if y1 == y2:
+            continue
+        crosses = (ys >= min(y1, y2)) & (ys < max(y1, y2))
+        x_at = x1 + (ys - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (xs < x_at)
+    return inside
+
+def _near_polyline(xs, ys, polyline, distance):
+    """True where a point is within distance of any segment of a closed polyline"""
+    near = np.zeros(np.broadcast(xs, ys).shape, dtype=bool)
+    for (x1, y1), (x2, y2) in zip(polyline, polyline[1:] + polyline[:1]):
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+        if length_sq == 0:
+            continue
+        t = np.clip(((xs - x1) * dx + (ys - y1) * dy) / length_sq, 0.0, 1.0)
+        near |= (xs - x1 - t * dx) ** 2 + (ys - y1 - t * dy) ** 2 <= distance * distance
+    return near
+
+
+class TrackField:
+    """Precomputed on-track lookup for cars of a given size"""
+
+    def __init__(self, occupancy, car_size=CAR_SIZE, samples=FOOTPRINT_SAMPLES):
+        self.occupancy = occupancy  # bool array indexed [y, x]
+        self.height, self.width = occupancy.shape
+
+        width = car_size[0] * FOOTPRINT_SCALE
+        height = car_size[1] * FOOTPRINT_SCALE
+        nu, nv = samples
+        u = (np.arange(nu) + 0.5) / nu * width - width / 2
+        v = (np.arange(nv) + 0.5) / nv * height - height / 2
+        self.sample_u, self.sample_v = (a.ravel() for a in np.meshgrid(u, v))
+        # Fraction of the footprint that must be on track
+        self.threshold = car_size[0] * car_size[1] * OVERLAP_RATIO / (width * height)
+
+    @classmethod
+    def from_polygons(cls, outer=None, inner=None, size=FIELD_SIZE, car_size=CAR_SIZE,
+                      border_width=BORDER_WIDTH):
+        """Rasterize the drivable area: inside outer, outside inner, off the border lines"""
+        outer = track_outer if outer is None else list(outer)
+        inner = track_inner if inner is None else list(inner)
+        xs = np.arange(size[0], dtype=np.float32)[None, :] + 0.5
+        ys = np.arange(size[1], dtype=np.float32)[:, None] + 0.5
+        occupancy = _inside_polygon(xs, ys, outer) & ~_inside_polygon(xs, ys, inner)
+        half = border_width / 2.0
+        occupancy &= ~_near_polyline(xs, ys, outer, half)
+        occupancy &= ~_near_polyline(xs, ys, inner, half)
+        return cls(occupancy, car_size)
+
+    def on_track_fraction(self, xs, ys, angles):
+        """Fraction of each car's footprint on track, for arrays of positions and angles"""
+        xs = np.asarray(xs, dtype=np.float64)[..., None]
+        ys = np.asarray(ys, dtype=np.float64)[..., None]
+        # pygame.transform.rotate turns counterclockwise on screen (y down)
+        rad = np.radians(np.asarray(angles, dtype=np.float64))[..., None]
+        cos, sin = np.cos(rad), np.sin(rad)
+        px = np.floor(xs + self.sample_u * cos + self.sample_v * sin).astype(np.intp)
+        py = np.floor(ys - self.sample_u * sin + self.sample_v * cos).astype(np.intp)
+        valid = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+        hits = np.zeros(px.shape, dtype=bool)
+        hits[valid] = self.occupancy[py[valid], px[valid]]
+        return hits.mean(axis=-1)
+
+    def on_track_many(self, xs, ys, angles):
+        """Vectorized on/off-track decision for many cars"""
+        return self.on_track_fraction(xs, ys, angles) > self.threshold
+
+    def on_track(self, x, y, angle):
+        return bool(self.on_track_fraction(x, y, angle) > self.threshold)